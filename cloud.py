@@ -1,3 +1,5 @@
+import os
+
 from config import MyFile, IS_CLOUD, BUCKET_NAME
 from google.cloud import storage
 
@@ -24,4 +26,34 @@ def upload_string_to_cloud_storage(output_file: str, string: str) -> None:
     bucket = client.bucket(BUCKET_NAME)
     blob: storage.Blob = bucket.blob(output_file)
     blob.upload_from_string(string, content_type="text/html")
-    print(f"Uploaded {output_file} to {BUCKET_NAME}")
\ No newline at end of file
+    print(f"Uploaded {output_file} to {BUCKET_NAME}")
+
+def download_file_from_cloud_storage(file: MyFile, generation: int | None = None) -> int | None:
+    """
+    Downloads a file from the bucket if it differs from the locally held generation.
+
+    Args:
+        file (MyFile): File to download, named as its blob in the bucket.
+        generation (int | None): Generation of the blob currently held locally, if any.
+
+    Returns:
+        int | None: Generation of the blob in the bucket, or None if it does not exist.
+    """
+    if not IS_CLOUD:
+        print(f"[LOCAL MODE] Would download {file}")
+        return None
+
+    client = storage.Client()
+    bucket = client.bucket(BUCKET_NAME)
+    blob: storage.Blob | None = bucket.get_blob(file.name)
+    if blob is None:
+        return None
+
+    if blob.generation != generation:
+        # Download next to the target and swap in, so readers never see a partial file
+        temp_path = f"{file.path}.download"
+        blob.download_to_filename(temp_path)
+        os.replace(temp_path, file.path)
+        print(f"Downloaded {file} from {BUCKET_NAME}")
+
+    return blob.generation
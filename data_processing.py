@@ -1,17 +1,26 @@
 import os
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from threading import BoundedSemaphore, Lock
 from bs4 import BeautifulSoup
 import re
 import requests
 from requests import Response
 
-from gtfs import download_gtfs, clean_gtfs, date_format
+from gtfs import download_gtfs, clean_gtfs, parse_gtfs_files, date_format
 from database import update_data_version, get_data_version, delete_old_data, \
-    is_db_connected, add_gtfs_site_log, add_to_database
-from utils import delete_file
-from config import GTFS_FILE, EXTRACTED_DIRECTORY, IGNORE_VERSION_CHECK, MOCK_OLD_DATE, OLD_DATE, \
-    GTFS_URL, MyFile, TRANSPORTS
+    is_db_connected, add_gtfs_site_log, add_to_database, update_catalog, \
+    get_update_checkpoint, save_update_checkpoint, save_collection_checkpoint, reset_update_checkpoint, \
+    count_version_documents, delete_version_documents, create_indexes
+from utils import delete_file, get_types_from_path, normalise_transport, get_file_hash
+from config import GTFS_FILE, EXTRACTED_DIRECTORY, STAGED_SNAPSHOT_FILE, IGNORE_VERSION_CHECK, MOCK_OLD_DATE, OLD_DATE, \
+    GTFS_URL, TRANSPORTS, INSERT_WORKERS, INSERT_BATCH_SIZE, ROUTE_TYPES, ROUTE_SUMMARY_COLLECTION, \
+    SERVICE_DAYS_COLLECTION, COLLECTION_INDEXES, CATALOG_REFRESH_SECONDS
 from cloud import upload_string_to_cloud_storage
+from snapshot import export_snapshot, publish_snapshot
+from summaries import build_route_summaries, build_service_days
 
 
 def update_gtfs_data():
@@ -31,28 +40,77 @@ def update_gtfs_data():
     # Fetch metadata
     data_version, download_link, soup = fetch_gtfs_data()
 
+    # Resume from the checkpoint of an unfinished update to this version
+    checkpoint = get_update_checkpoint(data_version)
+    stages: dict = checkpoint.get("stages", {})
+
+    # A committed version may still need its snapshot published and old data deleted
+    if "build" in stages and "publish" not in stages and get_data_version() == data_version:
+        print("Update already committed, resuming publish")
+        publish_update(data_version)
+        return True
+
     # Check if update needed
     if not check_if_update_needed(data_version):
         return False
 
-    # Update last updated date in the database (and site metadata in logs)
-    update_data_version(data_version)
+    if "publish" in stages:
+        reset_update_checkpoint(data_version)   # version was already published, so start over
+        stages = {}
+    elif stages:
+        print(f"Resuming update from checkpoint, completed stages: {', '.join(stages.keys())}")
+
+    # Log site metadata
     site_version, metadata_version = fetch_site_metadata()
     add_gtfs_site_log(data_version, site_version, metadata_version)
 
     # Parse transport types
     transports_dict = parse_transport_types(soup, list(TRANSPORTS.keys()))
 
-    # Download and process gtfs schedule files
-    download_and_extract_gtfs(download_link, transports_dict)
+    if "build" in stages:
+        print("Database already built, skipping download and build")
+        catalog = stages["build"]["catalog"]
+    else:
+        # Download and process gtfs schedule files, unless a previous run's extracted files are intact
+        if is_extraction_intact(stages.get("extract")):
+            print("Extracted files intact, skipping download and extraction")
+        else:
+            download_and_extract_gtfs(download_link, transports_dict, data_version, stages.get("download"))
+
+        # Build database
+        catalog = build_database(transports_dict, data_version, stages)
+
+    # Commit: point readers at the new version, only once every stage has succeeded
+    update_catalog(data_version, catalog)
+    update_data_version(data_version)
+    save_update_checkpoint(data_version, "commit", {})
+
+    publish_update(data_version)
+    return True
 
-    # Build database
-    build_database(transports_dict)
+
+def publish_update(data_version: datetime) -> None:
+    """
+    Publish the read snapshot of a committed version, then delete data of older versions.
+
+    Args:
+        data_version: Version of the GTFS data that was committed
+    """
+    stages: dict = get_update_checkpoint(data_version).get("stages", {})
+
+    publish_snapshot(stages["snapshot"]["sha256"])
+
+    # Workers read MongoDB at the version of their cached catalog, so keep old data until they have all
+    # refreshed it since the commit
+    committed_at: datetime = stages.get("commit", {}).get("completed_at", datetime.now())
+    remaining = CATALOG_REFRESH_SECONDS - (datetime.now() - committed_at).total_seconds()
+    if remaining > 0:
+        print(f"Waiting {remaining:.0f} seconds for workers to refresh their catalog...")
+        time.sleep(remaining)
 
     # Cleanup
     delete_old_data(data_version)
-
-    return True
+    save_update_checkpoint(data_version, "publish", {})
 
 
 def fetch_gtfs_data() -> tuple[datetime, str, BeautifulSoup]:
@@ -181,39 +239,310 @@ def check_if_update_needed(new_date: datetime) -> bool:
     return True
 
 
-def download_and_extract_gtfs(download_link: str, transports_dict: dict[str,str]) -> None:
+def download_and_extract_gtfs(download_link: str, transports_dict: dict[str,str], data_version: datetime,
+                              download_checkpoint: dict | None = None) -> None:
     """
-    Download GTFS file and extract relevant transport data.
+    Download GTFS file and extract relevant transport data, checkpointing each step.
 
     Args:
         download_link (str): URL to download GTFS zip
         transports_dict (dict[str,str]): Dictionary of transports and their corresponding numbers and types
+        data_version (datetime): Version of the GTFS data being downloaded
+        download_checkpoint (dict | None): Checkpoint of a previous run's download, if any
     """
-    # Download
-    download_gtfs(download_link, GTFS_FILE)
-
-    # Extract
+    # Download, unless a previous run's download is intact
+    if (download_checkpoint and os.path.isfile(GTFS_FILE.path)
+            and get_file_hash(GTFS_FILE.path) == download_checkpoint["sha256"]):
+        print("Downloaded file intact, skipping download")
+    else:
+        download_gtfs(download_link, GTFS_FILE)
+        save_update_checkpoint(data_version, "download", {
+            "sha256": get_file_hash(GTFS_FILE.path),
+            "size": os.path.getsize(GTFS_FILE.path),
+        })
+
+    # Extract into an empty folder, so files from other runs aren't ingested
+    delete_file(EXTRACTED_DIRECTORY)
     clean_gtfs(GTFS_FILE, EXTRACTED_DIRECTORY, transports_dict)
+    save_update_checkpoint(data_version, "extract", {
+        "files": [
+            {"path": os.path.relpath(file_path, EXTRACTED_DIRECTORY.path), "sha256": get_file_hash(file_path)}
+            for file_path in get_extracted_files()
+        ],
+    })
 
     # Delete gtfs zip file
     delete_file(GTFS_FILE)
 
 
-def build_database(transports_dict: dict[str,str]) -> None:
+def is_extraction_intact(extract_checkpoint: dict | None) -> bool:
     """
-    Build database from extracted GTFS files.
+    Check if the files extracted by a previous run are all present and unchanged.
 
     Args:
-        transports_dict: Dictionary of transport numbers and types
+        extract_checkpoint (dict | None): Checkpoint of a previous run's extraction, if any
     """
+    if not extract_checkpoint:
+        return False
 
-    # Process all extracted txt files, and delete them afterwards
-    for root, dirs, files in os.walk(EXTRACTED_DIRECTORY.path):
-        for filename in files:
-            data_file_path = MyFile(os.path.join(root, filename))
+    for file in extract_checkpoint["files"]:
+        file_path = os.path.join(EXTRACTED_DIRECTORY.path, file["path"])
+        if not os.path.isfile(file_path) or get_file_hash(file_path) != file["sha256"]:
+            return False
 
-            if data_file_path.name.endswith(".txt"):
-                add_to_database(data_file_path, transports_dict)
-                delete_file(data_file_path)
+    return True
 
+
+def get_extracted_files() -> list[str]:
+    """
+    Returns:
+        list[str]: Paths of all extracted txt files, largest first
+    """
+    file_paths = [
+        os.path.join(root, filename)
+        for root, dirs, files in os.walk(EXTRACTED_DIRECTORY.path)
+        for filename in files if filename.endswith(".txt")
+    ]
+    file_paths.sort(key=os.path.getsize, reverse=True)
+    return file_paths
+
+
+def build_database(transports_dict: dict[str,str], data_version: datetime, stages: dict) -> list[dict]:
+    """
+    Build database and read snapshot from extracted GTFS files, skipping stages a previous run completed.
+
+    Args:
+        transports_dict: Dictionary of transport numbers and types
+        data_version: Version of the GTFS data being built
+        stages: Stages completed by a previous run, from its checkpoint
+
+    Returns:
+        list[dict]: Catalog of the built collections, saved when the version is committed
+    """
+
+    # 1. Collect all extracted txt files, largest first so big files don't finish last
+    file_paths = get_extracted_files()
+
+    # 2. Insert collections not completed by a previous run
+    row_counts = get_completed_collections(stages.get("ingest"), data_version)
+    remaining_paths = [
+        file_path for file_path in file_paths
+        if get_collection_name(file_path, transports_dict) not in row_counts
+    ]
+    if row_counts:
+        print(f"Skipping completed collections: {', '.join(row_counts.keys())}")
+
+    row_counts.update(ingest_files(remaining_paths, transports_dict, data_version))
+
+    # 3. Index collections for the read endpoints' lookups
+    for file_path in file_paths:
+        file_type, transport_type = get_types_from_path(file_path, transports_dict)
+        create_indexes(f"{transport_type}_{file_type}", COLLECTION_INDEXES.get(file_type, []))
+
+    # 4. Aggregate derived collections once per version
+    derived_stages = {
+        "summaries": (ROUTE_SUMMARY_COLLECTION, build_route_summaries),
+        "service_days": (SERVICE_DAYS_COLLECTION, build_service_days),
+    }
+    derived_records: dict[str, list[dict]] = {}
+    derived_counts: dict[str, int] = {}
+
+    for stage, (collection_name, build) in derived_stages.items():
+        if stage in stages and "snapshot" in stages:
+            derived_counts[collection_name] = stages[stage]["count"]
+            continue
+
+        records = build(EXTRACTED_DIRECTORY, transports_dict, data_version)
+        if stage not in stages:
+            delete_version_documents(collection_name, data_version)
+            add_to_database(collection_name, records)     # raises if any failed, so the stage isn't checkpointed
+            create_indexes(collection_name, COLLECTION_INDEXES[collection_name])
+            save_update_checkpoint(data_version, stage, {"count": len(records)})
+
+        derived_records[collection_name] = records
+        derived_counts[collection_name] = len(records)
+
+    # 5. Catalog built collections, for the read path and cleanup once committed
+    catalog = build_catalog(file_paths, transports_dict, row_counts)
+    for collection_name, count in derived_counts.items():
+        catalog.append({
+            "name": collection_name,
+            "transport": None,
+            "route_type": None,
+            "file_type": collection_name,
+            "count": count,
+        })
+
+    # 6. Export read snapshot, staged until the version is committed
+    if "snapshot" not in stages:
+        export_snapshot(EXTRACTED_DIRECTORY, transports_dict, data_version,
+                        derived_records[ROUTE_SUMMARY_COLLECTION], derived_records[SERVICE_DAYS_COLLECTION], catalog)
+        save_update_checkpoint(data_version, "snapshot", {"sha256": get_file_hash(STAGED_SNAPSHOT_FILE.path)})
+
+    # 7. Delete extracted files, which a resumed run no longer needs, keeping the catalog for the commit
+    save_update_checkpoint(data_version, "build", {"catalog": catalog})
     delete_file(EXTRACTED_DIRECTORY)
+
+    return catalog
+
+
+def get_collection_name(file_path: str, transports_dict: dict[str,str]) -> str:
+    file_type, transport_type = get_types_from_path(file_path, transports_dict)
+    return f"{transport_type}_{file_type}"
+
+
+def get_completed_collections(ingest_checkpoint: dict | None, data_version: datetime) -> Counter[str]:
+    """
+    Find collections a previous run fully inserted, which still hold the expected number of records.
+
+    Args:
+        ingest_checkpoint: Checkpoint of a previous run's ingestion, if any
+        data_version: Version of the GTFS data being built
+
+    Returns:
+        Counter[str]: Number of records in each completed collection
+    """
+    completed: Counter[str] = Counter()
+    if not ingest_checkpoint:
+        return completed
+
+    for collection_name, count in ingest_checkpoint.get("collections", {}).items():
+        if count_version_documents(collection_name, data_version) == count:
+            completed[collection_name] = count
+
+    return completed
+
+
+def ingest_files(file_paths: list[str], transports_dict: dict[str,str], data_version: datetime) -> Counter[str]:
+    """
+    Parse files across processes and insert their records in batches as they stream back, checkpointing
+    each collection once all its records are inserted. Batches of all collections share a bounded pool of
+    insert workers, so files insert concurrently.
+
+    Args:
+        file_paths: Paths to the extracted GTFS files to insert
+        transports_dict: Dictionary of transport numbers and types
+        data_version: Version of the GTFS data being built
+
+    Returns:
+        Counter[str]: Number of records inserted to each collection
+
+    Raises:
+        Exception: if any file failed to parse, any insert failed or any collection is missing records
+            after inserting, after reporting the errors of each collection
+    """
+    # Remove records left by an interrupted insert
+    for file_path in file_paths:
+        delete_version_documents(get_collection_name(file_path, transports_dict), data_version)
+
+    row_counts: Counter[str] = Counter()
+    pending: Counter[str] = Counter()   # inserts not yet finished, per collection
+    parsed: set[str] = set()            # collections whose file has been fully parsed
+    checked: set[str] = set()           # collections whose inserted records have been counted
+    completed: set[str] = set()
+    failures: dict[str, list[str]] = {} # errors of failed parses and inserts, per collection
+    lock = Lock()
+
+    def complete_if_finished(collection_name: str) -> None:
+        # Claim the check with the lock held, then count outside it, so other collections' inserts don't wait on Atlas
+        with lock:
+            if (collection_name not in parsed or pending[collection_name] > 0 or collection_name in failures
+                    or collection_name in checked):
+                return
+            checked.add(collection_name)
+            expected = row_counts[collection_name]
+
+        inserted = count_version_documents(collection_name, data_version)
+        if inserted == expected:
+            save_collection_checkpoint(data_version, collection_name, inserted)
+            with lock:
+                completed.add(collection_name)
+        else:
+            with lock:
+                failures.setdefault(collection_name, []).append(f"inserted {inserted} of {expected} records")
+
+    def insert_batch(collection_name: str, records: list[dict]) -> None:
+        # A failed collection is reinserted by the next run, so stop writing to it, including batches
+        # already waiting for a worker
+        with lock:
+            if collection_name in failures:
+                return
+        add_to_database(collection_name, records)
+
+    def insert_finished(collection_name: str, future: Future) -> None:
+        pending_inserts.release()
+        with lock:
+            if future.exception() is not None:
+                failures.setdefault(collection_name, []).append(str(future.exception()))
+            pending[collection_name] -= 1
+        complete_if_finished(collection_name)
+
+    # Limits batches held in memory while waiting for an insert worker, which also caps concurrent writes
+    pending_inserts = BoundedSemaphore(INSERT_WORKERS * 2)
+    with ThreadPoolExecutor(max_workers=INSERT_WORKERS) as executor:
+        for collection_name, records in parse_gtfs_files(file_paths, transports_dict, data_version):
+            # Never checkpoint a collection whose file failed to parse
+            if isinstance(records, Exception):
+                with lock:
+                    failures.setdefault(collection_name, []).append(str(records))
+                continue
+
+            if records is None:
+                with lock:
+                    parsed.add(collection_name)
+                complete_if_finished(collection_name)
+                continue
+
+            with lock:
+                row_counts[collection_name] += len(records)
+
+            # Split chunks into batches, so workers insert a large file in parallel
+            for start in range(0, len(records), INSERT_BATCH_SIZE):
+                pending_inserts.acquire()
+                with lock:
+                    if collection_name in failures:
+                        pending_inserts.release()
+                        break
+                    pending[collection_name] += 1
+
+                future = executor.submit(insert_batch, collection_name, records[start:start + INSERT_BATCH_SIZE])
+                future.add_done_callback(lambda f, name=collection_name: insert_finished(name, f))
+
+    for collection_name, errors in sorted(failures.items()):
+        print(f"Failed to parse or insert {collection_name}: {len(errors)} errors, first: {errors[0]}")
+
+    incomplete = (parsed - completed) | failures.keys()
+    if incomplete:
+        raise Exception(f"Could not insert all records to: {', '.join(sorted(incomplete))}")
+
+    return row_counts
+
+
+def build_catalog(file_paths: list[str], transports_dict: dict[str,str], row_counts: Counter[str]) -> list[dict]:
+    """
+    Describe the collection built from each extracted GTFS file.
+
+    Args:
+        file_paths: Paths to the extracted GTFS files
+        transports_dict: Dictionary of transport numbers and types
+        row_counts: Number of records parsed for each collection
+
+    Returns:
+        list[dict]: Name, transport, route type, file type and row count of each collection
+    """
+    route_types = {normalise_transport(transport): route_type for transport, route_type in ROUTE_TYPES.items()}
+
+    catalog = []
+    for file_path in file_paths:
+        file_type, transport_type = get_types_from_path(file_path, transports_dict)
+        collection_name = f"{transport_type}_{file_type}"
+
+        catalog.append({
+            "name": collection_name,
+            "transport": transport_type,
+            "route_type": route_types.get(transport_type),
+            "file_type": file_type,
+            "count": row_counts[collection_name],
+        })
+
+    return catalog
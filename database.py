@@ -1,23 +1,51 @@
 import certifi
-import pandas as pd
-import numpy as np
+import threading
+import time
 
-from datetime import datetime
+from datetime import date, datetime
+from urllib.parse import parse_qs, urlsplit
 from pymongo import MongoClient
 from pymongo.database import Database
+from pymongo.errors import BulkWriteError
 from pymongo.server_api import ServerApi
 from pymongo.synchronous.collection import Collection
 
-from config import KEEP_OUTDATED_DATA, MONGO_URI, MONGO_DATABASE, LOGS_DATABASE, MyFile, MOCK_MONGODB_UNAVAILABLE
-from utils import get_types_from_path, get_keep_file_basenames
+from config import KEEP_OUTDATED_DATA, MONGO_URI, MONGO_DATABASE, LOGS_DATABASE, MOCK_MONGODB_UNAVAILABLE, \
+    ROUTE_SUMMARY_COLLECTION, CATALOG_REFRESH_SECONDS, CHECKPOINTS_COLLECTION, SERVICE_DAYS_COLLECTION
+from snapshot import get_snapshot_routes, get_snapshot_shapes, get_snapshot_shapes_by_ids, get_snapshot_route_summary, \
+    get_snapshot_trips, get_snapshot_service_days, get_snapshot_shape_points, get_snapshot_route_summaries, \
+    get_snapshot_version
+from spatial import GridIndex, build_grid_index
+from summaries import get_active_service_ids
+
+def uses_tls(uri: str) -> bool:
+    """Whether a MongoDB URI connects with TLS, which is the default for mongodb+srv:// (such as Atlas)."""
+    options = {key.lower(): values[-1].lower() for key, values in parse_qs(urlsplit(uri).query).items()}
+    option = options.get("tls", options.get("ssl"))
+    if option is not None:
+        return option == "true"
+    return uri.startswith("mongodb+srv://")
 
 # Mongo
+# The CA file is only passed with TLS, as pymongo otherwise takes it as turning TLS on, which a local mongod rejects
 client: MongoClient = MongoClient(
             MONGO_URI,
             server_api=ServerApi('1'),
-            tlsCAFile=certifi.where(),
+            **({"tlsCAFile": certifi.where()} if uses_tls(MONGO_URI) else {}),
         )
 
+# Catalog of collections, cached by each worker
+catalog_lock = threading.Lock()
+catalog_cache: dict | None = None
+catalog_checked: float | None = None
+
+# Service days of each transport, cached by each worker for the catalog's version
+service_days_cache: dict[str, tuple[str, list[dict]]] = {}
+
+# Spatial index of shape points, built by each worker for the snapshot's or catalog's version
+spatial_index_lock = threading.Lock()
+spatial_index_cache: tuple[str, GridIndex] | None = None
+
 def is_db_connected() -> bool:
     if MOCK_MONGODB_UNAVAILABLE:
         print("[TEST] Mocking MongoDB unavailable")
@@ -32,55 +60,90 @@ def is_db_connected() -> bool:
         print(f"     Error: {e}")
         return False
 
-def add_to_database(file: MyFile, transports: dict[str, str]) -> None:
-    try:
-        # 1. Select database
-        db: Database= client[MONGO_DATABASE]
+def add_to_database(collection_name: str, records: list[dict]) -> None:
+    """
+    Insert records to a collection, unordered so a failed record doesn't stop the others.
 
-        # 2. Load file
-        df = pd.read_csv(file.path)
+    Raises:
+        Exception: if any record could not be inserted, with how many were and the first error
+    """
+    # insert_many rejects an empty list
+    if not records:
+        return
 
-        # 3. Determine file and transport types to access target collection
-        file_type, transport_type = get_types_from_path(file.path, transports)
-        collection: Collection= db[f"{transport_type}_{file_type}"]
+    # 1. Select database and target collection
+    db: Database = client[MONGO_DATABASE]
+    collection: Collection = db[collection_name]
 
-        # 4. Dataframe modifications
-        df = df.replace({np.nan: None})         # remove NaN
-        df['version'] = get_data_version()      # add version to fields
-        if "route_short_name" in df.columns:    # convert route_short_name to string
-            df['route_short_name'] = df["route_short_name"].astype(str)
+    # 2. Save records to database
+    time_start = datetime.now()
+    print(f"Inserting {len(records)} records to {collection_name}...")
+
+    try:
+        collection.insert_many(records, ordered=False)
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        first_error = write_errors[0]["errmsg"] if write_errors else str(e)
+        raise Exception(
+            f"Inserted {e.details.get('nInserted', 0)} of {len(records)} records to {collection_name}, "
+            f"{len(write_errors)} failed: {first_error}"
+        ) from e
+
+    time_difference = (datetime.now() - time_start).seconds
+    print(f"        Successfully added records, took {time_difference} seconds")
+
+def count_version_documents(collection_name: str, version: datetime) -> int | None:
+    try:
+        db: Database = client[MONGO_DATABASE]
+        return db[collection_name].count_documents({"version": version})
 
-        # 5. Save file dataframe to database
-        records = df.to_dict('records')
-        time_start = datetime.now()
-        print(f"Inserting {len(records)} records to {transport_type}_{file_type}...")
+    except Exception as e:
+        print(e)
 
-        # Insertion logic
-        if collection is not None:
-            collection.insert_many(records, ordered=False)
+def delete_version_documents(collection_name: str, version: datetime) -> None:
+    """
+    Deletes documents of a version from a collection, such as those left by an interrupted insert.
+    """
+    try:
+        db: Database = client[MONGO_DATABASE]
+        result = db[collection_name].delete_many({"version": version})
 
-        time_difference = (datetime.now() - time_start).seconds
-        print(f"        Successfully added records, took {time_difference} seconds")
+        if result.deleted_count > 0:
+            print(f"Deleted {result.deleted_count} partially inserted records from {collection_name}")
 
     except Exception as e:
         print(e)
 
-def update_data_version(version: datetime) -> None:
+def create_indexes(collection_name: str, indexes: list[list[str]]) -> None:
+    """
+    Creates ascending indexes on a collection, if they don't already exist.
+
+    Args:
+        collection_name (str): Collection to index.
+        indexes (list[list[str]]): Fields of each index.
+    """
     try:
-        # 1. Select database and collection
         db: Database = client[MONGO_DATABASE]
-        collection: Collection= db.misc
 
-        # 2. Upsert data
-        collection.update_one(
-            {"_id": "gtfs_version"},            # match any document (or none)
-            {"$set": {"version": version.isoformat()}},     # update this field
-            upsert=True                         # insert if no document exists
-        )
+        for fields in indexes:
+            db[collection_name].create_index([(field, 1) for field in fields])
 
     except Exception as e:
         print(e)
 
+def update_data_version(version: datetime) -> None:
+    # Raises on failure, as this commits the version to readers
+    # 1. Select database and collection
+    db: Database = client[MONGO_DATABASE]
+    collection: Collection= db.misc
+
+    # 2. Upsert data
+    collection.update_one(
+        {"_id": "gtfs_version"},            # match any document (or none)
+        {"$set": {"version": version.isoformat()}},     # update this field
+        upsert=True                         # insert if no document exists
+    )
+
 def get_data_version() -> datetime:
     try:
         db: Database = client[MONGO_DATABASE]
@@ -103,17 +166,10 @@ def delete_old_data(version: datetime) -> None:
         # 1. Select database'
         db: Database = client[MONGO_DATABASE]
 
-        # 2. Get a list of Collections and iterate through them
-        collections = db.list_collection_names()
-        saved_gtfs_folders = get_keep_file_basenames()
-        # print(f"Collections: {collections} | Saved GTFS Folders: {saved_gtfs_folders}")
-
-        # Keep only collections that contain any of the saved GTFS folder names
-        collections = [
-            c for c in collections
-            if any(folder in c for folder in saved_gtfs_folders)
-        ]
-        # print(f"Filtered Collections: {collections}")
+        # 2. Get collections of the current and previous catalog, and iterate through them
+        catalog = db.misc.find_one({"_id": "catalog"}) or {}
+        entries = catalog.get("collections", []) + catalog.get("previous_collections", [])
+        collections = [entry["name"] for entry in entries]
 
         for collection_name in collections:
             collection = db[collection_name]
@@ -135,6 +191,138 @@ def delete_old_data(version: datetime) -> None:
     except Exception as e:
         print(e)
 
+def update_catalog(version: datetime, collections: list[dict]) -> None:
+    """
+    Saves the catalog of collections built for a version of the GTFS data, as part of committing it.
+
+    Collections only found in the previous catalog are kept alongside, so cleanup still reaches
+    collections of transports that are no longer built.
+
+    Args:
+        version (datetime): Version of the GTFS data the collections were built for.
+        collections (list[dict]): Name, transport, route type, file type and row count of each collection.
+
+    Raises:
+        Exception: if the catalog could not be saved
+    """
+    # 1. Select database and collection
+    db: Database = client[MONGO_DATABASE]
+    collection: Collection = db.misc
+
+    # 2. Find collections that are no longer built
+    previous_catalog = collection.find_one({"_id": "catalog"}) or {}
+    previous_entries = previous_catalog.get("collections", [])
+    if previous_catalog.get("version") == version.isoformat():
+        # Retrying a commit, so the previous version's collections were already carried over
+        previous_entries = previous_catalog.get("previous_collections", [])
+
+    names = {entry["name"] for entry in collections}
+    previous_collections = [entry for entry in previous_entries if entry["name"] not in names]
+
+    # 3. Upsert catalog
+    collection.update_one(
+        {"_id": "catalog"},
+        {"$set": {
+            "version": version.isoformat(),
+            "collections": collections,
+            "previous_collections": previous_collections,
+        }},
+        upsert=True
+    )
+
+def get_catalog() -> dict | None:
+    """
+    Gets the catalog of collections, cached in process and only reloaded when the data version changes.
+
+    The data version is checked at most once every CATALOG_REFRESH_SECONDS.
+    """
+    global catalog_cache, catalog_checked
+
+    if catalog_checked is not None and time.monotonic() - catalog_checked < CATALOG_REFRESH_SECONDS:
+        return catalog_cache
+
+    with catalog_lock:
+        # Another thread may have refreshed while waiting for the lock
+        if catalog_checked is not None and time.monotonic() - catalog_checked < CATALOG_REFRESH_SECONDS:
+            return catalog_cache
+
+        # Failed attempts also wait for the next interval, so threads don't queue retries on a slow or down Atlas
+        catalog_checked = time.monotonic()
+        try:
+            data_version = get_data_version()
+            if catalog_cache is None or datetime.fromisoformat(catalog_cache["version"]) != data_version:
+                db: Database = client[MONGO_DATABASE]
+                catalog_cache = db.misc.find_one({"_id": "catalog"}, {"_id": 0})
+
+        except Exception as e:
+            print(e)
+
+    return catalog_cache
+
+def get_update_checkpoint(version: datetime) -> dict:
+    """
+    Gets the checkpoint of an update to a version, recording the stages it completed.
+
+    Returns:
+        dict: Checkpoint document, or an empty dictionary if there is none.
+    """
+    try:
+        db: Database = client[LOGS_DATABASE]
+        collection: Collection = db[CHECKPOINTS_COLLECTION]
+
+        return collection.find_one({"_id": version.isoformat()}) or {}
+
+    except Exception as e:
+        print(e)
+        return {}
+
+def save_update_checkpoint(version: datetime, stage: str, details: dict) -> None:
+    """
+    Records that a stage of the update to a version has completed.
+
+    Args:
+        version (datetime): Version being updated to.
+        stage (str): Name of the completed stage.
+        details (dict): Details needed to verify or resume from the stage, such as artifact hashes.
+    """
+    try:
+        db: Database = client[LOGS_DATABASE]
+        collection: Collection = db[CHECKPOINTS_COLLECTION]
+
+        collection.update_one(
+            {"_id": version.isoformat()},
+            {"$set": {f"stages.{stage}": {**details, "completed_at": datetime.now()}}},
+            upsert=True
+        )
+
+    except Exception as e:
+        print(e)
+
+def save_collection_checkpoint(version: datetime, collection_name: str, count: int) -> None:
+    """
+    Records that all records of a collection have been inserted for a version.
+    """
+    try:
+        db: Database = client[LOGS_DATABASE]
+        collection: Collection = db[CHECKPOINTS_COLLECTION]
+
+        collection.update_one(
+            {"_id": version.isoformat()},
+            {"$set": {f"stages.ingest.collections.{collection_name}": count}},
+            upsert=True
+        )
+
+    except Exception as e:
+        print(e)
+
+def reset_update_checkpoint(version: datetime) -> None:
+    try:
+        db: Database = client[LOGS_DATABASE]
+        db[CHECKPOINTS_COLLECTION].delete_one({"_id": version.isoformat()})
+
+    except Exception as e:
+        print(e)
+
 def add_gtfs_site_log(gtfs_last_updated: datetime, site_last_updated: datetime, metadata_modified: datetime) -> None:
     """
     Adds or updates a GTFS site metadata log in the database for tracking updates.
@@ -174,17 +362,39 @@ def add_gtfs_site_log(gtfs_last_updated: datetime, site_last_updated: datetime,
     except Exception as e:
         print(e)
 
+def get_version_filter() -> dict:
+    """
+    Returns:
+        dict: Query matching documents of the committed version, so MongoDB reads skip a version still
+            being built and one awaiting cleanup, or an empty query until a catalog exists.
+    """
+    catalog = get_catalog()
+    return {"version": datetime.fromisoformat(catalog["version"])} if catalog else {}
+
 def get_routes(route_type: str|None):
+    # Serve from local snapshot if available, falling back to MongoDB
+    documents = get_snapshot_routes(route_type)
+    if documents is not None:
+        return documents
+
     try:
         db: Database = client[MONGO_DATABASE]
-        collection_names: list[str] = db.list_collection_names()
+        catalog = get_catalog()
 
-        # Filters collections in database by presence of "route" in the name, and route type, if it exists
+        # Filters catalogued routes collections by route type, if it exists
         filtered_names: list[str] = []
-        if route_type:
-            filtered_names = [name for name in collection_names if "routes" in name and route_type in name]
+        if catalog:
+            filtered_names = [
+                entry["name"] for entry in catalog["collections"]
+                if entry["file_type"] == "routes" and (not route_type or entry["route_type"] == route_type)
+            ]
         else:
-            filtered_names = [name for name in collection_names if "routes" in name]
+            # Catalog is written by build_database, so match collection names until one exists
+            collection_names: list[str] = db.list_collection_names()
+            filtered_names = [
+                name for name in collection_names
+                if "routes" in name and (not route_type or route_type in name)
+            ]
 
         collections: list[Collection] = [db[collection] for collection in filtered_names]
 
@@ -192,45 +402,221 @@ def get_routes(route_type: str|None):
         documents = []
         for collection in collections:
             # Get list of all documents, excluding "_id" and "version" field
-            documents.extend(list(collection.find({}, {"_id": 0, "version": 0})))
+            documents.extend(list(collection.find(get_version_filter(), {"_id": 0, "version": 0})))
 
         return documents
     except Exception as e:
         print(e)
 
 def get_shapes(shape_id: str):
+    documents = get_snapshot_shapes(shape_id)
+    if documents is not None:
+        return documents
+
     try:
         db: Database = client[MONGO_DATABASE]
         collection: Collection = db["metropolitan_tram_shapes"]
 
         # Get list of all documents, excluding "_id" and "version" field
-        documents = list(collection.find({"shape_id": shape_id}, {"_id": 0, "version": 0}))
+        documents = list(collection.find({"shape_id": shape_id, **get_version_filter()}, {"_id": 0, "version": 0}))
         return documents
     except Exception as e:
         print(e)
 
+def get_shapes_by_ids(shape_ids: list[str]) -> list[dict]:
+    if not shape_ids:
+        return []
+
+    documents = get_snapshot_shapes_by_ids(shape_ids)
+    if documents is not None:
+        return documents
+
+    try:
+        db: Database = client[MONGO_DATABASE]
+        collection: Collection = db["metropolitan_tram_shapes"]
+
+        # Get points of every shape in one query, grouped by shape in sequence order
+        documents = list(collection.find(
+            {"shape_id": {"$in": shape_ids}, **get_version_filter()},
+            {"_id": 0, "version": 0},
+            sort=[("shape_id", 1), ("shape_pt_sequence", 1)]
+        ))
+        return documents
+    except Exception as e:
+        print(e)
+        return []
+
+def get_route_summary(route_id: str) -> dict | None:
+    summary = get_snapshot_route_summary(route_id)
+    if summary is not None:
+        return summary or None
+
+    try:
+        db: Database = client[MONGO_DATABASE]
+        collection: Collection = db[ROUTE_SUMMARY_COLLECTION]
+
+        # Get summary of the committed version, excluding "_id" and "version" field
+        return collection.find_one({"route_id": route_id, **get_version_filter()}, {"_id": 0, "version": 0},
+                                   sort=[("version", -1)])
+    except Exception as e:
+        print(e)
+
 # Returns the distinct shapes for a specific route
 def get_route_shapes(route_id: str) -> list[str]:
+    summary = get_route_summary(route_id)
+    if summary:
+        return summary["shape_ids"] or []
+
+    # Summaries are only built with a new version, so fall back to the route's trips until then
     try:
         db: Database = client[MONGO_DATABASE]
         collection: Collection = db["metropolitan_tram_trips"]
 
         shapes: list[str] = collection.distinct(
             "shape_id",
-            {"route_id": route_id}
+            {"route_id": route_id, **get_version_filter()}
         )
 
-        return shapes
+        return sorted(shapes)
+    except Exception as e:
+        print(e)
+        return []
+
+def get_service_days(transport: str) -> list[dict] | None:
+    """
+    Gets the service days of a transport's services, for the committed version of the GTFS data.
+
+    Returns:
+        list[dict] | None: Service days, or None if they are unavailable, so callers don't take
+            a missing collection as no services running.
+    """
+    service_days = get_snapshot_service_days(transport)
+    if service_days:
+        return service_days
+
+    try:
+        catalog = get_catalog()
+        if not catalog:
+            return None
+
+        # Service days only change with the version, so reuse them until the catalog changes
+        cached = service_days_cache.get(transport)
+        if cached and cached[0] == catalog["version"]:
+            return cached[1]
+
+        db: Database = client[MONGO_DATABASE]
+        collection: Collection = db[SERVICE_DAYS_COLLECTION]
+
+        version = datetime.fromisoformat(catalog["version"])
+        service_days = list(collection.find({"transport": transport, "version": version}, {"_id": 0, "version": 0}))
+        if not service_days:
+            # Every committed version has services, so none means they were never built
+            return None
+
+        service_days_cache[transport] = (catalog["version"], service_days)
+        return service_days
     except Exception as e:
         print(e)
+        return None
+
+def get_trips(route_id: str, day: date | None = None) -> list[dict] | None:
+    """
+    Gets the trips of a route, or only those running on a day if given.
+
+    Returns:
+        list[dict] | None: Trips, or None if they (or the service days needed to filter by day) are unavailable.
+    """
+    service_ids = None
+    if day:
+        service_days = get_service_days("metropolitan_tram")
+        if service_days is None:
+            return None
+        service_ids = get_active_service_ids(service_days, day)
+
+    documents = get_snapshot_trips(route_id, service_ids)
+    if documents is not None:
+        return documents
 
-def get_trips(route_id: str):
     try:
         db: Database = client[MONGO_DATABASE]
         collection: Collection = db["metropolitan_tram_trips"]
 
+        query: dict = {"route_id": route_id, **get_version_filter()}
+        if service_ids is not None:
+            query["service_id"] = {"$in": service_ids}
+
         # Get list of all documents, excluding "_id" and "version" field
-        documents = list(collection.find({"route_id": route_id}, {"_id": 0, "version": 0}))
+        documents = list(collection.find(query, {"_id": 0, "version": 0}))
         return documents
     except Exception as e:
-        print(e)
\ No newline at end of file
+        print(e)
+        return None
+
+def get_spatial_index() -> GridIndex | None:
+    """
+    Gets the spatial index of shape points, built once per version of the GTFS data.
+
+    Built from the local snapshot when there is one, so MongoDB is only needed without a snapshot.
+    """
+    global spatial_index_cache
+
+    # Version of the local snapshot, otherwise of the catalog
+    version = get_snapshot_version()
+    from_snapshot = version is not None
+    if not from_snapshot:
+        catalog = get_catalog()
+        if not catalog:
+            return None
+        version = catalog["version"]
+
+    cached = spatial_index_cache
+    if cached and cached[0] == version:
+        return cached[1]
+
+    with spatial_index_lock:
+        # Another thread may have built the index while waiting for the lock
+        if spatial_index_cache and spatial_index_cache[0] == version:
+            return spatial_index_cache[1]
+
+        try:
+            shape_points = get_snapshot_shape_points(version) if from_snapshot else None
+            route_summaries = get_snapshot_route_summaries() if shape_points is not None else None
+
+            # Falling back to MongoDB, at the catalog's version
+            if shape_points is None or route_summaries is None:
+                catalog = get_catalog()
+                if not catalog:
+                    return None
+
+                db: Database = client[MONGO_DATABASE]
+                version = catalog["version"]
+                version_filter = {"version": datetime.fromisoformat(version)}
+
+                shape_points = []
+                for entry in catalog["collections"]:
+                    if entry["file_type"] == "shapes":
+                        shape_points.extend(db[entry["name"]].find(
+                            version_filter,
+                            {"_id": 0, "shape_id": 1, "shape_pt_lat": 1, "shape_pt_lon": 1}
+                        ))
+                route_summaries = list(db[ROUTE_SUMMARY_COLLECTION].find(
+                    version_filter,
+                    {"_id": 0, "route_id": 1, "shape_ids": 1}
+                ))
+
+            spatial_index_cache = (version, build_grid_index(shape_points, route_summaries))
+            return spatial_index_cache[1]
+        except Exception as e:
+            print(e)
+            return None
+
+def get_nearby_routes(lat: float, lon: float, radius: float) -> list[dict] | None:
+    """
+    Returns:
+        list[dict] | None: Nearest point of each route within the radius, or None if no spatial index is available.
+    """
+    index = get_spatial_index()
+    if index is None:
+        return None
+
+    return index.query(lat, lon, radius)
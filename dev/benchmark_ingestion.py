@@ -0,0 +1,95 @@
+"""
+Benchmarks how extraction and parsing of a GTFS feed scale with the number of worker processes.
+
+Records are parsed and streamed back exactly as in build_database, but are counted instead of
+inserted, so the results measure the pipeline without MongoDB.
+
+Usage:
+    python -m dev.benchmark_ingestion path/to/gtfs.zip [--max-workers N]
+"""
+import argparse
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from config import MyFile, TRANSPORTS
+from gtfs import clean_gtfs, parse_gtfs_files
+
+# Transport numbers of the GTFS Schedule feed, for every mode in config.TRANSPORTS
+ALL_TRANSPORTS: dict[str, str] = {
+    "1": "Regional Train",
+    "2": "Metropolitan Train",
+    "3": "Metropolitan Tram",
+    "4": "Metro Bus",
+    "5": "Regional Coach",
+    "6": "Regional Bus",
+    "11": "SkyBus",
+}
+
+
+def run(gtfs_zip: MyFile, transports: dict[str, str], workers: int) -> tuple[float, float, int]:
+    """
+    Extract and parse the feed once with the given number of workers.
+
+    Returns:
+        tuple[float, float, int]: Extraction seconds, parsing seconds, and number of records parsed.
+    """
+    output_folder = MyFile(tempfile.mkdtemp(prefix="gtfs_benchmark_"))
+    try:
+        time_start = datetime.now()
+        clean_gtfs(gtfs_zip, output_folder, transports, workers=workers)
+        extract_time = (datetime.now() - time_start).total_seconds()
+
+        file_paths = [
+            os.path.join(root, filename)
+            for root, dirs, files in os.walk(output_folder.path)
+            for filename in files if filename.endswith(".txt")
+        ]
+        file_paths.sort(key=os.path.getsize, reverse=True)
+
+        time_start = datetime.now()
+        total_records = 0
+        for collection_name, records in parse_gtfs_files(file_paths, transports, datetime.now(), workers=workers):
+            if isinstance(records, Exception):
+                raise records
+            if records is not None:
+                total_records += len(records)
+        parse_time = (datetime.now() - time_start).total_seconds()
+
+        return extract_time, parse_time, total_records
+    finally:
+        shutil.rmtree(output_folder.path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("gtfs_zip", help="Path to a full GTFS Schedule zip")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    gtfs_zip = MyFile(os.path.abspath(args.gtfs_zip))
+    transports = {number: name for number, name in ALL_TRANSPORTS.items() if name in TRANSPORTS}
+
+    # 1, 2, 4, ... up to and including max workers
+    worker_counts = []
+    workers = 1
+    while workers < args.max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(args.max_workers)
+
+    results = []
+    for workers in worker_counts:
+        print(f"Running with {workers} workers...")
+        results.append((workers, *run(gtfs_zip, transports, workers)))
+
+    baseline = results[0][1] + results[0][2]
+    print(f"\n{'workers':>8} {'extract s':>10} {'parse s':>10} {'records':>10} {'speedup':>8}")
+    for workers, extract_time, parse_time, total_records in results:
+        speedup = baseline / (extract_time + parse_time)
+        print(f"{workers:>8} {extract_time:>10.2f} {parse_time:>10.2f} {total_records:>10} {speedup:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares size and encode/decode time of the JSON and columnar MessagePack responses of /shapes,
+/routeShapes and /trips, on synthetic documents shaped like Metropolitan Tram data.
+
+Usage:
+    python -m dev.benchmark_wire_format [--points N] [--trips N] [--repeat N]
+"""
+import argparse
+import gzip
+import json
+import random
+import timeit
+
+from flask import Flask, jsonify
+
+from wire_format import pack_columnar, unpack_columnar
+
+
+def make_shapes(shape_count: int, points: int) -> list[dict]:
+    """Shape points following a random walk around Melbourne, as returned for a route's shapes."""
+    documents = []
+    for shape in range(shape_count):
+        lat, lon, distance = -37.8136, 144.9631, 0.0
+        for sequence in range(1, points + 1):
+            documents.append({
+                "shape_id": f"3-1-mjp-{shape + 1}.1.H",
+                "shape_pt_lat": round(lat, 6),
+                "shape_pt_lon": round(lon, 6),
+                "shape_pt_sequence": sequence,
+                "shape_dist_traveled": round(distance, 2),
+            })
+            lat += random.uniform(-0.0004, 0.0004)
+            lon += random.uniform(-0.0004, 0.0004)
+            distance += random.uniform(5, 40)
+    return documents
+
+
+def make_trips(count: int) -> list[dict]:
+    """Trips of a single route, as returned by /trips."""
+    return [
+        {
+            "route_id": "3-1-mjp-1",
+            "service_id": f"T{trip % 6}_{trip % 3}",
+            "trip_id": f"{trip}.T{trip % 6}.3-1-mjp-1.{trip % 4}.H",
+            "shape_id": f"3-1-mjp-{trip % 4 + 1}.1.H",
+            "trip_headsign": "East Coburg" if trip % 2 else "South Melbourne Beach",
+            "direction_id": trip % 2,
+        }
+        for trip in range(count)
+    ]
+
+
+def compare(name: str, documents: list[dict], app: Flask, repeat: int) -> None:
+    with app.app_context():
+        json_bytes = jsonify(documents).get_data()
+    msgpack_bytes = pack_columnar(documents)
+
+    # Check the columnar payload round trips within fixed-point precision
+    decoded = unpack_columnar(msgpack_bytes)
+    assert len(decoded) == len(documents)
+    for original, roundtrip in zip(documents, decoded):
+        for field, value in original.items():
+            assert roundtrip[field] == value or abs(roundtrip[field] - value) < 1e-6, field
+
+    with app.app_context():
+        json_encode = timeit.timeit(lambda: jsonify(documents).get_data(), number=repeat) / repeat
+    msgpack_encode = timeit.timeit(lambda: pack_columnar(documents), number=repeat) / repeat
+    json_decode = timeit.timeit(lambda: json.loads(json_bytes), number=repeat) / repeat
+    msgpack_decode = timeit.timeit(lambda: unpack_columnar(msgpack_bytes), number=repeat) / repeat
+
+    print(f"\n{name} ({len(documents)} documents)")
+    print(f"{'format':>10} {'bytes':>10} {'gzip bytes':>11} {'encode ms':>10} {'decode ms':>10}")
+    for format_name, data, encode, decode in (
+        ("json", json_bytes, json_encode, json_decode),
+        ("msgpack", msgpack_bytes, msgpack_encode, msgpack_decode),
+    ):
+        print(f"{format_name:>10} {len(data):>10} {len(gzip.compress(data)):>11} "
+              f"{encode * 1000:>10.2f} {decode * 1000:>10.2f}")
+    print(f"msgpack is {len(msgpack_bytes) / len(json_bytes):.1%} of the JSON size")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=800, help="Points per shape")
+    parser.add_argument("--trips", type=int, default=3000, help="Trips of the route")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    app = Flask(__name__)
+
+    compare("/shapes", make_shapes(1, args.points), app, args.repeat)
+    compare("/routeShapes", make_shapes(4, args.points), app, args.repeat)
+    compare("/trips", make_trips(args.trips), app, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
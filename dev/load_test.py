@@ -0,0 +1,291 @@
+"""
+Load tests the read endpoints of main.py under gunicorn, backed by a local MongoDB seeded from a
+synthetic or real GTFS feed.
+
+A weighted mix of /routes?type=, /shapes?id=, /routeShapes?id=, /routeSummary?id= and /trips?id=
+requests, with IDs sampled from the loaded data, is replayed at increasing concurrency. Throughput,
+latency percentiles and error rates are reported per endpoint, and can be saved and compared against
+a baseline run.
+
+IDs and request order are drawn from --seed, and client i of each level uses seed + i. The seed and
+sampled IDs are saved with the results and reused when comparing against them, so both runs replay
+the same requests.
+
+Usage:
+    python -m dev.load_test [--mongo-uri URI] [--gtfs-zip path/to/gtfs.zip] [--skip-seed]
+                            [--backend snapshot|mongo] [--workers N] [--threads N]
+                            [--concurrency 1,4,16,32] [--duration SECONDS] [--mix routes=1,shapes=4,...]
+                            [--seed N] [--output results.json] [--baseline results.json]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import requests
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ["routes", "shapes", "routeShapes", "routeSummary", "trips"]
+SYNTHETIC_VERSION = datetime(2025, 1, 1)
+
+
+def seed(args: argparse.Namespace) -> None:
+    """
+    Build the database and read snapshot, in the current directory, from a real or synthetic feed.
+    """
+    # Imported here, so MONGO_URI is set before config is loaded
+    from config import EXTRACTED_DIRECTORY, STAGED_SNAPSHOT_FILE, MyFile
+    from data_processing import build_database
+    from database import update_catalog, update_data_version
+    from gtfs import clean_gtfs
+    from snapshot import publish_snapshot
+    from utils import get_file_hash
+    from dev.benchmark_ingestion import ALL_TRANSPORTS
+    from test.synthetic_gtfs import write_synthetic_gtfs
+
+    if args.gtfs_zip:
+        transports = ALL_TRANSPORTS
+        clean_gtfs(MyFile(args.gtfs_zip), EXTRACTED_DIRECTORY, transports)
+        version = datetime.fromtimestamp(os.path.getmtime(args.gtfs_zip))
+    else:
+        transports = {"3": "Metropolitan Tram"}
+        write_synthetic_gtfs(EXTRACTED_DIRECTORY.path, args.routes, args.trips_per_route, args.points_per_shape)
+        version = SYNTHETIC_VERSION
+
+    catalog = build_database(transports, version, {})
+    update_catalog(version, catalog)
+    update_data_version(version)
+    publish_snapshot(get_file_hash(STAGED_SNAPSHOT_FILE.path))
+    print(f"Seeded {args.gtfs_zip or 'synthetic feed'} as version {version}")
+
+
+def start_server(args: argparse.Namespace, cwd: str) -> subprocess.Popen:
+    """
+    Start main:app under gunicorn, as in the Dockerfile, and wait until it is healthy.
+    """
+    env = {**os.environ, "MONGO_URI": args.mongo_uri}
+    env.pop("IS_CLOUD", None)
+
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--bind", f"127.0.0.1:{args.port}",
+            "--workers", str(args.workers),
+            "--threads", str(args.threads),
+            "--timeout", "60",
+            "--pythonpath", REPO_DIRECTORY,
+            "main:app",
+        ],
+        cwd=cwd,
+        env=env,
+    )
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{args.port}/health", timeout=5).status_code == 200:
+                return server
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+
+    server.terminate()
+    raise RuntimeError("Server did not become healthy within 60 seconds")
+
+
+def sample_ids(base_url: str, sample_size: int, rng: random.Random) -> dict[str, list]:
+    """
+    Sample route and shape IDs from the loaded data, through the API itself.
+    """
+    from config import ROUTE_TYPES
+
+    routes = requests.get(f"{base_url}/routes?type=tram", timeout=30).json()
+    all_route_ids = sorted(route["route_id"] for route in routes)
+    route_ids = rng.sample(all_route_ids, min(sample_size, len(all_route_ids)))
+
+    shape_ids = []
+    for route_id in route_ids:
+        summary = requests.get(f"{base_url}/routeSummary?id={route_id}", timeout=30).json()
+        shape_ids.extend(summary.get("shape_ids") or [])
+
+    if not route_ids or not shape_ids:
+        raise RuntimeError("No tram routes or shapes found, has the database been seeded?")
+
+    return {"route_types": sorted(set(ROUTE_TYPES.values())), "route_ids": route_ids, "shape_ids": shape_ids}
+
+
+def choose_request(mix: dict[str, int], ids: dict[str, list], rng: random.Random) -> tuple[str, str]:
+    endpoint = rng.choices(list(mix.keys()), weights=list(mix.values()))[0]
+
+    if endpoint == "routes":
+        return endpoint, f"/routes?type={rng.choice(ids['route_types'])}"
+    if endpoint == "shapes":
+        return endpoint, f"/shapes?id={rng.choice(ids['shape_ids'])}"
+    return endpoint, f"/{endpoint}?id={rng.choice(ids['route_ids'])}"
+
+
+def run_level(base_url: str, concurrency: int, duration: float, mix: dict[str, int], ids: dict[str, list],
+              seed: int) -> dict:
+    """
+    Replay the request mix from concurrent clients, each sending its next request once the last returns.
+
+    Client i draws its requests from its own generator seeded with seed + i, so runs replay the same order.
+
+    Returns:
+        dict: Requests, throughput, latency percentiles and error rate of each endpoint.
+    """
+    samples: list[tuple[str, float, bool]] = []
+    deadline = time.monotonic() + duration
+
+    def client(rng: random.Random) -> None:
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            endpoint, path = choose_request(mix, ids, rng)
+            start = time.perf_counter()
+            try:
+                ok = session.get(base_url + path, timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            samples.append((endpoint, time.perf_counter() - start, ok))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i in range(concurrency):
+            executor.submit(client, random.Random(seed + i))
+
+    results = {}
+    for endpoint in ["all", *mix.keys()]:
+        endpoint_samples = [sample for sample in samples if endpoint in ("all", sample[0])]
+        if not endpoint_samples:
+            continue
+
+        latencies = np.array([latency for _, latency, _ in endpoint_samples]) * 1000
+        errors = sum(1 for _, _, ok in endpoint_samples if not ok)
+        results[endpoint] = {
+            "requests": len(endpoint_samples),
+            "throughput": len(endpoint_samples) / duration,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "error_rate": errors / len(endpoint_samples),
+        }
+
+    return results
+
+
+def print_report(levels: list[dict], baseline: dict | None) -> None:
+    baseline_levels = {level["concurrency"]: level["endpoints"] for level in baseline["levels"]} if baseline else {}
+
+    print(f"\n{'clients':>7} {'endpoint':>12} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'errors':>7}" + (f" {'req/s vs base':>14} {'p95 vs base':>12}" if baseline else ""))
+
+    for level in levels:
+        for endpoint, stats in level["endpoints"].items():
+            line = (f"{level['concurrency']:>7} {endpoint:>12} {stats['requests']:>9} {stats['throughput']:>8.1f} "
+                    f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} "
+                    f"{stats['error_rate']:>7.1%}")
+
+            base = baseline_levels.get(level["concurrency"], {}).get(endpoint)
+            if base:
+                line += (f" {stats['throughput'] / base['throughput'] - 1:>+14.1%}"
+                         f" {stats['p95_ms'] / base['p95_ms'] - 1:>+12.1%}")
+            print(line)
+
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for item in mix.split(","):
+        endpoint, weight = item.split("=")
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"{endpoint} is not a valid endpoint. Valid endpoints are: {', '.join(ENDPOINTS)}.")
+        weights[endpoint] = int(weight)
+    return weights
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--gtfs-zip", help="Seed from a real GTFS Schedule zip, instead of a synthetic feed")
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse data seeded by a previous run")
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "gtfs_load_test"),
+                        help="Directory holding the seeded read snapshot")
+    parser.add_argument("--routes", type=int, default=25, help="Routes of the synthetic feed")
+    parser.add_argument("--trips-per-route", type=int, default=600)
+    parser.add_argument("--points-per-shape", type=int, default=800)
+    parser.add_argument("--backend", choices=["snapshot", "mongo"], default="snapshot",
+                        help="Serve reads from the local snapshot, or from MongoDB only")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--workers", type=int, default=1, help="Gunicorn workers")
+    parser.add_argument("--threads", type=int, default=8, help="Gunicorn threads per worker")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="Concurrent clients of each level")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of each level")
+    parser.add_argument("--mix", default="routes=1,shapes=4,routeShapes=2,routeSummary=1,trips=3",
+                        help="Weight of each endpoint")
+    parser.add_argument("--sample-size", type=int, default=20, help="Routes to sample IDs from")
+    parser.add_argument("--seed", type=int,
+                        help="Seed of the sampled IDs and request order (default: the baseline's seed, or 0)")
+    parser.add_argument("--output", help="Save results as JSON, for use as a baseline")
+    parser.add_argument("--baseline", help="Compare against results saved by a previous run")
+    args = parser.parse_args()
+
+    os.environ["MONGO_URI"] = args.mongo_uri
+    for path_argument in ("gtfs_zip", "output", "baseline"):
+        if getattr(args, path_argument):
+            setattr(args, path_argument, os.path.abspath(getattr(args, path_argument)))
+
+    # Replay the baseline's workload, unless another seed is given
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.seed is None:
+        args.seed = baseline.get("seed", 0) if baseline else 0
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    os.chdir(args.work_dir)
+    mix = parse_mix(args.mix)
+    if baseline and baseline["config"].get("mix") != args.mix:
+        print(f"Warning: mix {args.mix} differs from the baseline's {baseline['config'].get('mix')}")
+
+    if not args.skip_seed:
+        seed(args)
+
+    # Without a snapshot in its directory, the server falls back to MongoDB
+    server_directory = args.work_dir if args.backend == "snapshot" else tempfile.mkdtemp(prefix="gtfs_load_test_")
+    server = start_server(args, server_directory)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        if baseline and "ids" in baseline and baseline.get("seed") == args.seed:
+            ids = baseline["ids"]
+            print(f"Reusing {len(ids['route_ids'])} routes and {len(ids['shape_ids'])} shapes sampled by the baseline")
+        else:
+            ids = sample_ids(base_url, args.sample_size, random.Random(args.seed))
+
+        levels = []
+        for concurrency in [int(level) for level in args.concurrency.split(",")]:
+            print(f"Running {concurrency} clients for {args.duration} seconds...")
+            levels.append({
+                "concurrency": concurrency,
+                "endpoints": run_level(base_url, concurrency, args.duration, mix, ids, args.seed),
+            })
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_report(levels, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "seed": args.seed, "ids": ids, "levels": levels}, f, indent=2)
+        print(f"\nSaved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
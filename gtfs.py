@@ -1,13 +1,28 @@
+import multiprocessing
+from multiprocessing.queues import Queue
 import os
+import shutil
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from queue import Empty
+from typing import Iterator
 
+import numpy as np
+import pandas as pd
 import requests
-import io
 
-from config import MyFile, SKIP_DOWNLOAD, TRANSPORTS
+from config import MyFile, SKIP_DOWNLOAD, TRANSPORTS, PARSE_WORKERS, PARSE_CHUNK_MB
+from utils import get_types_from_path
 
 date_format = "%d %B %Y"  # matches "19 September 2025"
 
+SAMPLE_ROWS = 1000          # Rows read to estimate the memory use of a file
+RECORD_MEMORY_FACTOR = 4    # Memory of parsed records, relative to their dataframe
+
+# Set in each parse worker process by init_parse_worker
+parse_queue: Queue | None = None
+
 def download_gtfs(download_link: str, file: MyFile) -> None:
     """
     Download a GTFS ZIP file from a URL.
@@ -30,47 +45,200 @@ def download_gtfs(download_link: str, file: MyFile) -> None:
 
     print(f"Downloaded {file}")
 
-def clean_gtfs(gtfs_zip: MyFile, output_folder: MyFile, transport_dict: dict[str,str]) -> None:
+def clean_gtfs(gtfs_zip: MyFile, output_folder: MyFile, transport_dict: dict[str,str],
+               workers: int = PARSE_WORKERS) -> None:
     """
-    Extract selected files from inner ZIPs inside a GTFS outer ZIP.
+    Extract selected files from inner ZIPs inside a GTFS outer ZIP, one inner ZIP per worker process.
 
     Parameters:
         gtfs_zip (MyFile): Path to the outer GTFS ZIP file.
         output_folder (MyFile): Base folder where extracted files will go.
         transport_dict (dict[str,str]): Only process these modes of transportation.
+        workers (int): Number of worker processes.
     """
     # Ensures output folder exists
     os.makedirs(output_folder.path, exist_ok=True)
 
-    # 1. Open outer GTFS zip file
+    # 1. Find the inner zip of each transport to process
     with zipfile.ZipFile(gtfs_zip.path, 'r') as gtfsRead:
-
-        # 2. Iterate over all files in the zip
-        print("Saving files...")
-        for transport in gtfsRead.namelist():
+        transports = [
+            transport for transport in gtfsRead.namelist()
+            if transport.split('/')[0] in transport_dict and transport.endswith(".zip")
+        ]
+
+    # 2. Extract inner zips in parallel
+    print("Saving files...")
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = []
+        for transport in transports:
             transport_number = transport.split('/')[0]      # first part of the path, e.g. '2'
+            keep_files = TRANSPORTS[transport_dict[transport_number]]
+            futures.append(executor.submit(extract_transport, gtfs_zip.path, transport, output_folder.path, keep_files))
+
+        for future in futures:
+            future.result()
+
+
+def extract_transport(gtfs_zip_path: str, transport: str, output_path: str, keep_files: list[str]) -> None:
+    """
+    Extract the kept files of one transport's inner ZIP, streaming through disk to bound memory use.
+
+    Parameters:
+        gtfs_zip_path (str): Path to the outer GTFS ZIP file.
+        transport (str): Path of the inner ZIP within the outer ZIP, e.g. '2/google_transit.zip'.
+        output_path (str): Base folder where extracted files will go.
+        keep_files (list[str]): Names of the files to extract.
+    """
+    transport_number = transport.split('/')[0]
+
+    # 1. Create subfolder for the transport number
+    subfolder = os.path.join(output_path, transport_number)
+    os.makedirs(subfolder, exist_ok=True)
+
+    # 2. Copy the inner zip to disk, rather than reading it into memory
+    inner_path = os.path.join(subfolder, "transport.zip")
+    with zipfile.ZipFile(gtfs_zip_path, 'r') as gtfsRead:
+        with gtfsRead.open(transport) as source, open(inner_path, 'wb') as destination:
+            shutil.copyfileobj(source, destination)
+
+    # 3. Save the files specified in keep_files
+    with zipfile.ZipFile(inner_path, 'r') as transitRead:
+        for file in transitRead.namelist():
+            if file in keep_files:
+                out_path = os.path.join(subfolder, file)
+
+                with transitRead.open(file) as source, open(out_path, 'wb') as destination:
+                    shutil.copyfileobj(source, destination)
+
+                print(f"        {file} from {transport} to {out_path}")
+
+    os.remove(inner_path)
+
+
+def load_gtfs_dataframe(file_path: str) -> pd.DataFrame:
+    """
+    Load an extracted GTFS file into a dataframe, normalising columns shared by every store.
 
-            # Only process if in keep_folders and is a .zip file
-            if transport_number in transport_dict and transport.endswith(".zip"):
-                transport_name = transport_dict[transport_number]
+    Parameters:
+        file_path (str): Path to the extracted GTFS .txt file.
+    """
+    return normalise_gtfs_dataframe(pd.read_csv(file_path))
+
+
+def normalise_gtfs_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    if "route_short_name" in df.columns:    # convert route_short_name to string
+        df['route_short_name'] = df["route_short_name"].astype(str)
+
+    return df
 
-                # 3. Create subfolder for the transport number
-                subfolder = os.path.join(output_folder.path, transport_number)
-                os.makedirs(subfolder, exist_ok=True)
 
-                # 4. Read the zip file within the Transport Number's directory
-                inner_data = gtfsRead.read(transport)
+def get_chunk_rows(file_path: str, chunk_mb: int) -> int:
+    """
+    Estimate how many rows of a GTFS file make a chunk of records of about the target size.
+
+    Parameters:
+        file_path (str): Path to the extracted GTFS .txt file.
+        chunk_mb (int): Target size of a chunk of records, in megabytes.
+    """
+    sample = pd.read_csv(file_path, nrows=SAMPLE_ROWS)
+    if sample.empty:
+        return SAMPLE_ROWS
+
+    # Records are dictionaries, and are pickled back to the main process, so take several times the dataframe size
+    row_bytes = sample.memory_usage(deep=True).sum() / len(sample) * RECORD_MEMORY_FACTOR
+    return max(SAMPLE_ROWS, int(chunk_mb * 1024 * 1024 / row_bytes))
 
-                with zipfile.ZipFile(io.BytesIO(inner_data), 'r') as transitRead:
-                    for file in transitRead.namelist():
 
-                        # 5. Save the files specified in keep_files
-                        if file in TRANSPORTS[transport_name]:
-                            data = transitRead.read(file)
-                            out_path = os.path.join(subfolder, file)
+def init_parse_worker(queue: Queue) -> None:
+    global parse_queue
+    parse_queue = queue
 
-                            # Save to disk
-                            with open(out_path, 'wb') as f:
-                                f.write(data)
 
-                            print(f"        {file} from {transport} to {out_path}")
+def parse_gtfs_file(file_path: str, transports: dict[str, str], version: datetime, chunk_mb: int) -> int:
+    """
+    Parse a GTFS file into chunks of database records, putting each chunk on the parse queue.
+
+    A (collection_name, None) entry is put last once the whole file is parsed, or a
+    (collection_name, Exception) entry if parsing failed, so a partly parsed file is never taken as finished.
+
+    Returns:
+        int: Number of records parsed.
+    """
+    file_type, transport_type = get_types_from_path(file_path, transports)
+    collection_name = f"{transport_type}_{file_type}"
+    total_records = 0
+
+    try:
+        for df in pd.read_csv(file_path, chunksize=get_chunk_rows(file_path, chunk_mb)):
+            df = normalise_gtfs_dataframe(df)
+            df = df.replace({np.nan: None})     # remove NaN
+            df['version'] = version             # add version to fields
+
+            records = df.to_dict('records')
+            parse_queue.put((collection_name, records))
+            total_records += len(records)
+    except Exception as e:
+        # Sent as a plain Exception, as the original may not be picklable
+        parse_queue.put((collection_name, Exception(f"Could not parse {file_path}: {type(e).__name__}: {e}")))
+        return total_records
+
+    parse_queue.put((collection_name, None))
+    return total_records
+
+
+def parse_gtfs_files(file_paths: list[str], transports: dict[str, str], version: datetime,
+                     workers: int = PARSE_WORKERS, chunk_mb: int = PARSE_CHUNK_MB
+                     ) -> Iterator[tuple[str, list[dict] | Exception | None]]:
+    """
+    Parse GTFS files across a process pool, streaming chunks of records back as they are ready.
+
+    Chunks travel through a bounded queue, so workers pause while the consumer falls behind.
+
+    Parameters:
+        file_paths (list[str]): Paths to the extracted GTFS .txt files.
+        transports (dict[str, str]): Dictionary of transport numbers and types.
+        version (datetime): Version added to every record.
+        workers (int): Number of worker processes.
+        chunk_mb (int): Target size of each chunk of records, in megabytes.
+
+    Yields:
+        tuple[str, list[dict] | Exception | None]: Target collection name and a chunk of its records,
+            None once all records of the collection's file have been yielded, or the Exception that
+            stopped its file from being parsed.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue(maxsize=workers)
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                   initializer=init_parse_worker, initargs=(queue,))
+    futures = [executor.submit(parse_gtfs_file, path, transports, version, chunk_mb) for path in file_paths]
+
+    try:
+        remaining_files = len(futures)
+        while remaining_files:
+            try:
+                collection_name, records = queue.get(timeout=1)
+            except Empty:
+                # Surface failed or crashed workers instead of waiting forever
+                for future in futures:
+                    if future.done() and future.exception():
+                        raise future.exception()
+                continue
+
+            if records is None or isinstance(records, Exception):
+                remaining_files -= 1
+            yield collection_name, records
+
+        for future in futures:
+            future.result()
+
+    finally:
+        # Drain the queue so workers blocked on a full queue can finish
+        for future in futures:
+            future.cancel()
+        while not all(future.done() for future in futures):
+            try:
+                queue.get(timeout=1)
+            except Empty:
+                pass
+        executor.shutdown()
@@ -1,13 +1,30 @@
-from database import get_data_version, get_routes, is_db_connected, get_shapes, get_trips, get_route_shapes
+from database import get_data_version, get_routes, is_db_connected, get_shapes, get_trips, get_route_shapes, \
+    get_route_summary, get_nearby_routes, get_shapes_by_ids
 from data_processing import update_gtfs_data
-from datetime import datetime
+from datetime import date, datetime
 from cloud import upload_file_to_cloud_storage
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
+from config import ROUTE_TYPES, NEARBY_DEFAULT_RADIUS, NEARBY_MAX_RADIUS
+from snapshot import start_snapshot_refresh
+from wire_format import MSGPACK_MIMETYPE, pack_columnar
 
 
 # Flask instance
 app = Flask(__name__)
 
+# Each gunicorn worker imports the app, so each fetches and refreshes its own snapshot
+start_snapshot_refresh()
+
+def negotiated_response(documents: list[dict]) -> Response:
+    """Returns documents as JSON by default, or as columnar MessagePack if the Accept header prefers it."""
+    if request.accept_mimetypes.best_match(["application/json", MSGPACK_MIMETYPE]) == MSGPACK_MIMETYPE:
+        response = Response(pack_columnar(documents or []), mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = jsonify(documents)
+
+    response.vary.add("Accept")
+    return response
+
 @app.route("/update", methods=["POST"])
 def update():
     """Update GTFS data endpoint."""
@@ -66,7 +83,7 @@ def routes():
 
     if route_type:
         route_type = route_type.lower()     # normalisation
-        allowed_route_types = ["tram", "train", "bus"]
+        allowed_route_types = sorted(set(ROUTE_TYPES.values()))
 
         # Checks if inputted route type contains a word of the transport options
         if not route_type in allowed_route_types:
@@ -83,7 +100,7 @@ def shapes():
     """Gets all shapes/geo-paths for a specified shape_id."""
     shape_id = request.args.get("id")
     gtfs_shapes = get_shapes(shape_id)
-    return jsonify(gtfs_shapes), 200
+    return negotiated_response(gtfs_shapes), 200
 
 @app.route("/routeShapes", methods=["GET"])
 def routeShapes():
@@ -91,20 +108,83 @@ def routeShapes():
     route_id = request.args.get("id")
     shape_ids = get_route_shapes(route_id)
 
-    # Accumulate all shapes data for each shape id
-    gtfs_shapes = []
-    for shape in shape_ids:
-        shape_data = get_shapes(shape)
-        gtfs_shapes.extend(shape_data)
+    # Get all shapes data of the route in one query
+    gtfs_shapes = get_shapes_by_ids(shape_ids)
+
+    return negotiated_response(gtfs_shapes), 200
+
+@app.route("/routeSummary", methods=["GET"])
+def routeSummary():
+    """Gets the trip count, shape IDs, headsigns and bounding box of a specified route_id."""
+    route_id = request.args.get("id")
+    summary = get_route_summary(route_id)
+
+    if not summary:
+        return jsonify({
+            "status": "not found",
+            "reason": f"No summary for route {route_id}."
+        }), 404
 
-    return jsonify(gtfs_shapes)
+    return jsonify(summary), 200
 
 @app.route("/trips", methods=["GET"])
 def trips():
-    """Gets all trips for a specified route_id."""
+    """Gets all trips for a specified route_id, or only those running on a date (YYYY-MM-DD or YYYYMMDD)."""
     route_id = request.args.get("id")
-    gtfs_trips = get_trips(route_id)
-    return jsonify(gtfs_trips), 200
+    date_string: str|None = request.args.get("date")
+
+    day: date|None = None
+    if date_string:
+        try:
+            day = date.fromisoformat(date_string)
+        except ValueError:
+            return jsonify({
+                "status": "bad request",
+                "reason": f"{date_string} is not a valid date. Dates must be YYYY-MM-DD or YYYYMMDD."
+            }), 400
+
+    gtfs_trips = get_trips(route_id, day)
+    if gtfs_trips is None:
+        return jsonify({
+            "status": "unavailable",
+            "reason": "Trips are not available, as neither the snapshot nor MongoDB could be read."
+        }), 503
+
+    return negotiated_response(gtfs_trips), 200
+
+@app.route("/nearby", methods=["GET"])
+def nearby():
+    """Gets the routes passing within radius metres of a location, with the nearest point of each route's shapes."""
+    try:
+        lat = float(request.args.get("lat"))
+        lon = float(request.args.get("lon"))
+        radius = float(request.args.get("radius", NEARBY_DEFAULT_RADIUS))
+    except (TypeError, ValueError):
+        return jsonify({
+            "status": "bad request",
+            "reason": "lat and lon are required, and lat, lon and radius must be numbers."
+        }), 400
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({
+            "status": "bad request",
+            "reason": f"{lat}, {lon} is not a valid location."
+        }), 400
+
+    if not 0 < radius <= NEARBY_MAX_RADIUS:
+        return jsonify({
+            "status": "bad request",
+            "reason": f"{radius} is not a valid radius. Radius must be between 0 and {NEARBY_MAX_RADIUS} metres."
+        }), 400
+
+    nearby_routes = get_nearby_routes(lat, lon, radius)
+    if nearby_routes is None:
+        return jsonify({
+            "status": "unavailable",
+            "reason": "Spatial index is not available, as neither the snapshot nor MongoDB could be read."
+        }), 503
+
+    return jsonify(nearby_routes), 200
 
 # For local testing Flask app
 if __name__ == "__main__":
@@ -0,0 +1,322 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from config import MyFile, SNAPSHOT_FILE, STAGED_SNAPSHOT_FILE, SNAPSHOT_REFRESH_SECONDS, SKIP_SNAPSHOT, \
+    ROUTE_SUMMARY_COLLECTION, SERVICE_DAYS_COLLECTION
+from cloud import upload_file_to_cloud_storage, download_file_from_cloud_storage
+from gtfs import load_gtfs_dataframe
+from utils import get_types_from_path, get_file_hash
+
+# Columns looked up by the read endpoints
+INDEXED_COLUMNS = ["route_id", "shape_id"]
+
+# Refresh state of a worker, updated by its refresh thread
+refresh_thread: threading.Thread | None = None
+snapshot_generation: int | None = None
+
+
+def export_snapshot(folder: MyFile, transports: dict[str, str], version: datetime,
+                    route_summaries: list[dict], service_days: list[dict], catalog: list[dict]) -> None:
+    """
+    Export extracted GTFS files to a read-only SQLite snapshot, staged in cloud storage until the
+    version is committed and the snapshot is published with publish_snapshot.
+
+    Each file becomes a table named after its MongoDB collection.
+
+    Args:
+        folder (MyFile): Folder containing the extracted GTFS files.
+        transports (dict[str, str]): Dictionary of transport numbers and types.
+        version (datetime): Version of the GTFS data being exported.
+        route_summaries (list[dict]): Route summaries, stored as JSON documents keyed by route_id.
+        service_days (list[dict]): Bitsets of the dates each service runs on.
+        catalog (list[dict]): Catalog of collections, used to find tables by transport and file type.
+    """
+    temp_path = f"{STAGED_SNAPSHOT_FILE.path}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    time_start = datetime.now()
+    print(f"Exporting snapshot to {STAGED_SNAPSHOT_FILE}...")
+
+    connection = sqlite3.connect(temp_path)
+    try:
+        # 1. Record version of the snapshot
+        connection.execute("CREATE TABLE misc (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("INSERT INTO misc VALUES ('gtfs_version', ?)", (version.isoformat(),))
+
+        # 2. Save each extracted file to its own table
+        for root, dirs, files in os.walk(folder.path):
+            for filename in files:
+                if not filename.endswith(".txt"):
+                    continue
+
+                file_path = os.path.join(root, filename)
+                file_type, transport_type = get_types_from_path(file_path, transports)
+                table = f"{transport_type}_{file_type}"
+
+                df = load_gtfs_dataframe(file_path)
+                df.to_sql(table, connection, index=False)
+
+                # 3. Index columns used for lookups
+                for column in INDEXED_COLUMNS:
+                    if column in df.columns:
+                        connection.execute(f'CREATE INDEX "{table}_{column}" ON "{table}" ("{column}")')
+
+        # 4. Save route summaries, which hold lists and nested documents
+        connection.execute(f'CREATE TABLE "{ROUTE_SUMMARY_COLLECTION}" (route_id TEXT, document TEXT)')
+        connection.executemany(
+            f'INSERT INTO "{ROUTE_SUMMARY_COLLECTION}" VALUES (?, ?)',
+            [
+                (summary["route_id"], json.dumps({key: value for key, value in summary.items() if key not in ("_id", "version")}))
+                for summary in route_summaries
+            ]
+        )
+        connection.execute(f'CREATE INDEX "{ROUTE_SUMMARY_COLLECTION}_route_id" ON "{ROUTE_SUMMARY_COLLECTION}" (route_id)')
+
+        # 5. Save service days
+        connection.execute(
+            f'CREATE TABLE "{SERVICE_DAYS_COLLECTION}" '
+            '(service_id, transport TEXT, start_date TEXT, days INTEGER, bitset BLOB)'
+        )
+        connection.executemany(
+            f'INSERT INTO "{SERVICE_DAYS_COLLECTION}" VALUES (:service_id, :transport, :start_date, :days, :bitset)',
+            service_days
+        )
+        connection.execute(
+            f'CREATE INDEX "{SERVICE_DAYS_COLLECTION}_transport" ON "{SERVICE_DAYS_COLLECTION}" (transport)'
+        )
+
+        # 6. Save catalog of tables
+        connection.execute("CREATE TABLE catalog (name TEXT, transport TEXT, route_type TEXT, file_type TEXT, count INTEGER)")
+        connection.executemany(
+            "INSERT INTO catalog VALUES (:name, :transport, :route_type, :file_type, :count)",
+            catalog
+        )
+
+        connection.commit()
+        connection.execute("ANALYZE")
+    finally:
+        connection.close()
+
+    # 7. Stage the snapshot, keeping a copy in the bucket so another instance can publish it
+    os.replace(temp_path, STAGED_SNAPSHOT_FILE.path)
+    time_difference = (datetime.now() - time_start).seconds
+    print(f"        Successfully exported snapshot, took {time_difference} seconds")
+
+    upload_file_to_cloud_storage(STAGED_SNAPSHOT_FILE)
+
+
+def publish_snapshot(sha256: str) -> None:
+    """
+    Publish the staged snapshot to readers, once its version is committed.
+
+    Args:
+        sha256 (str): Hash of the staged snapshot when it was exported, to check it is still the same snapshot.
+
+    Raises:
+        Exception: if the staged snapshot is missing or has changed
+    """
+    # Staged on another instance, or this instance restarted since exporting
+    if not os.path.isfile(STAGED_SNAPSHOT_FILE.path):
+        download_file_from_cloud_storage(STAGED_SNAPSHOT_FILE)
+
+    if not os.path.isfile(STAGED_SNAPSHOT_FILE.path) or get_file_hash(STAGED_SNAPSHOT_FILE.path) != sha256:
+        raise Exception(f"Staged snapshot {STAGED_SNAPSHOT_FILE} is missing or does not match its checkpoint")
+
+    # Swap in a copy of the new snapshot and publish it for other instances, keeping the staged
+    # snapshot until then so a failed publish can be retried
+    temp_path = f"{SNAPSHOT_FILE.path}.tmp"
+    shutil.copyfile(STAGED_SNAPSHOT_FILE.path, temp_path)
+    os.replace(temp_path, SNAPSHOT_FILE.path)
+    upload_file_to_cloud_storage(SNAPSHOT_FILE)
+
+    os.remove(STAGED_SNAPSHOT_FILE.path)
+    print(f"Published snapshot {SNAPSHOT_FILE}")
+
+
+def refresh_snapshot() -> None:
+    """
+    Fetches the snapshot from cloud storage, if it differs from the one held locally.
+    """
+    global snapshot_generation
+
+    try:
+        snapshot_generation = download_file_from_cloud_storage(SNAPSHOT_FILE, snapshot_generation)
+    except Exception as e:
+        print(e)
+
+
+def start_snapshot_refresh() -> None:
+    """
+    Fetches the snapshot when a worker starts, then every SNAPSHOT_REFRESH_SECONDS from a background
+    thread, so reads never wait on cloud storage.
+    """
+    global refresh_thread
+
+    if SKIP_SNAPSHOT or (refresh_thread is not None and refresh_thread.is_alive()):
+        return
+
+    refresh_snapshot()
+
+    def refresh_loop() -> None:
+        while True:
+            time.sleep(SNAPSHOT_REFRESH_SECONDS)
+            refresh_snapshot()
+
+    refresh_thread = threading.Thread(target=refresh_loop, name="snapshot-refresh", daemon=True)
+    refresh_thread.start()
+
+
+def open_snapshot() -> sqlite3.Connection | None:
+    """
+    Opens the local snapshot read-only.
+
+    Returns:
+        sqlite3.Connection | None: Connection returning rows as dictionaries, or None if no snapshot is available.
+    """
+    # Only reads the local file, which start_snapshot_refresh keeps up to date
+    if SKIP_SNAPSHOT or not os.path.isfile(SNAPSHOT_FILE.path):
+        return None
+
+    connection = sqlite3.connect(f"file:{SNAPSHOT_FILE.path}?mode=ro", uri=True)
+    connection.row_factory = lambda cursor, row: {column[0]: value for column, value in zip(cursor.description, row)}
+    return connection
+
+
+def query_snapshot(query: str, params: tuple | dict = ()) -> list[dict] | None:
+    """
+    Runs a query against the local snapshot.
+
+    Returns:
+        list[dict] | None: Matching rows, or None if the snapshot is unavailable or cannot answer the query.
+    """
+    try:
+        connection = open_snapshot()
+        if connection is None:
+            return None
+
+        try:
+            return connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+
+    except sqlite3.Error as e:
+        print(e)
+        return None
+
+
+def get_snapshot_routes(route_type: str | None) -> list[dict] | None:
+    # Filters catalogued routes tables by route type, if it exists
+    tables = query_snapshot(
+        "SELECT name FROM catalog WHERE file_type = 'routes' AND (:route_type IS NULL OR route_type = :route_type)",
+        {"route_type": route_type}
+    )
+    if tables is None:
+        return None
+
+    documents = []
+    for table in tables:
+        rows = query_snapshot(f'SELECT * FROM "{table["name"]}"')
+        if rows is None:
+            return None
+        documents.extend(rows)
+
+    return documents
+
+
+def get_snapshot_shapes(shape_id: str) -> list[dict] | None:
+    return query_snapshot(
+        'SELECT * FROM "metropolitan_tram_shapes" WHERE shape_id = ? ORDER BY rowid',
+        (shape_id,)
+    )
+
+
+def get_snapshot_shapes_by_ids(shape_ids: list[str]) -> list[dict] | None:
+    # Points of every shape in one query, grouped by shape in file order
+    placeholders = ", ".join("?" * len(shape_ids))
+    return query_snapshot(
+        f'SELECT * FROM "metropolitan_tram_shapes" WHERE shape_id IN ({placeholders}) ORDER BY shape_id, rowid',
+        tuple(shape_ids)
+    )
+
+
+def get_snapshot_route_summary(route_id: str) -> dict | None:
+    """
+    Returns:
+        dict | None: Summary of the route, an empty dictionary if the route is not in the snapshot,
+            or None if the snapshot is unavailable.
+    """
+    rows = query_snapshot(
+        f'SELECT document FROM "{ROUTE_SUMMARY_COLLECTION}" WHERE route_id = ?',
+        (str(route_id),)
+    )
+    if rows is None:
+        return None
+
+    return json.loads(rows[0]["document"]) if rows else {}
+
+
+def get_snapshot_service_days(transport: str) -> list[dict] | None:
+    return query_snapshot(
+        f'SELECT service_id, start_date, days, bitset FROM "{SERVICE_DAYS_COLLECTION}" WHERE transport = ?',
+        (transport,)
+    )
+
+
+def get_snapshot_trips(route_id: str, service_ids: list | None = None) -> list[dict] | None:
+    if service_ids is None:
+        return query_snapshot(
+            'SELECT * FROM "metropolitan_tram_trips" WHERE route_id = ? ORDER BY rowid',
+            (route_id,)
+        )
+
+    placeholders = ", ".join("?" * len(service_ids))
+    return query_snapshot(
+        f'SELECT * FROM "metropolitan_tram_trips" WHERE route_id = ? AND service_id IN ({placeholders}) ORDER BY rowid',
+        (route_id, *service_ids)
+    )
+
+
+def get_snapshot_version() -> str | None:
+    """
+    Returns:
+        str | None: Version of the GTFS data in the snapshot (ISO format), or None if the snapshot is unavailable.
+    """
+    rows = query_snapshot("SELECT value FROM misc WHERE key = 'gtfs_version'")
+    return rows[0]["value"] if rows else None
+
+
+def get_snapshot_shape_points(version: str) -> list[dict] | None:
+    """
+    Returns:
+        list[dict] | None: Coordinates of every catalogued shape point, or None if the snapshot is
+            unavailable or was replaced by another version.
+    """
+    if get_snapshot_version() != version:
+        return None
+
+    tables = query_snapshot("SELECT name FROM catalog WHERE file_type = 'shapes'")
+    if tables is None:
+        return None
+
+    points = []
+    for table in tables:
+        rows = query_snapshot(f'SELECT shape_id, shape_pt_lat, shape_pt_lon FROM "{table["name"]}"')
+        if rows is None:
+            return None
+        points.extend(rows)
+
+    return points
+
+
+def get_snapshot_route_summaries() -> list[dict] | None:
+    rows = query_snapshot(f'SELECT document FROM "{ROUTE_SUMMARY_COLLECTION}"')
+    if rows is None:
+        return None
+
+    return [json.loads(row["document"]) for row in rows]
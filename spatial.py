@@ -0,0 +1,156 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from config import NEARBY_CELL_METRES
+
+EARTH_RADIUS_METRES = 6_371_000
+METRES_PER_DEGREE = EARTH_RADIUS_METRES * math.pi / 180
+
+# Cells are keyed by x * CELL_KEY_FACTOR + y, which is unique while |y| < CELL_KEY_FACTOR / 2
+CELL_KEY_FACTOR = 2 ** 32
+
+
+class GridIndex:
+    """
+    Shape points bucketed into square cells of an equirectangular projection, for radius searches.
+
+    Points are sorted by cell, so the points of a cell are a contiguous slice of the coordinate arrays.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, shape_indices: np.ndarray, shape_ids: list[str],
+                 shape_routes: list[list[str]], cell_metres: float = NEARBY_CELL_METRES):
+        """
+        Args:
+            lats (np.ndarray): Latitude of each shape point.
+            lons (np.ndarray): Longitude of each shape point.
+            shape_indices (np.ndarray): Index into shape_ids of the shape each point belongs to.
+            shape_ids (list[str]): Distinct shape IDs.
+            shape_routes (list[list[str]]): Route IDs following each shape, in the order of shape_ids.
+            cell_metres (float): Side of each grid cell.
+        """
+        self.cell_metres = cell_metres
+        self.shape_ids = shape_ids
+        self.shape_routes = shape_routes
+
+        # Projection is scaled to the network's mean latitude, so cells are roughly square
+        self.lon_scale = math.cos(math.radians(float(lats.mean()))) if len(lats) else 1.0
+
+        # 1. Sort points by cell
+        keys = self.cell_key(*self.to_cells(lats, lons))
+        order = np.argsort(keys, kind="stable")
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.shape_indices = shape_indices[order]
+
+        # 2. Map each cell to its slice of points
+        cell_keys, starts, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        self.cells: dict[int, tuple[int, int]] = {
+            key: (start, start + count)
+            for key, start, count in zip(cell_keys.tolist(), starts.tolist(), counts.tolist())
+        }
+
+    def __len__(self) -> int:
+        return len(self.lats)
+
+    def to_cells(self, lats: np.ndarray | float, lons: np.ndarray | float) -> tuple:
+        cells_x = np.floor(lons * METRES_PER_DEGREE * self.lon_scale / self.cell_metres).astype(np.int64)
+        cells_y = np.floor(lats * METRES_PER_DEGREE / self.cell_metres).astype(np.int64)
+        return cells_x, cells_y
+
+    @staticmethod
+    def cell_key(cells_x, cells_y):
+        return cells_x * CELL_KEY_FACTOR + cells_y
+
+    def query(self, lat: float, lon: float, radius: float) -> list[dict]:
+        """
+        Find the routes with a shape point within radius metres of a location.
+
+        Returns:
+            list[dict]: Nearest point of each route, with route_id, shape_id, shape_pt_lat, shape_pt_lon
+                and distance (in metres), closest first.
+        """
+        # 1. Cells overlapping the square around the location
+        # (longitude is scaled to the location's latitude, so no nearby cells are missed away from the mean)
+        lon_radius = radius / (METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        lat_radius = radius / METRES_PER_DEGREE
+        min_x, min_y = self.to_cells(lat - lat_radius, lon - lon_radius)
+        max_x, max_y = self.to_cells(lat + lat_radius, lon + lon_radius)
+
+        slices = [
+            self.cells.get(int(self.cell_key(cell_x, cell_y)))
+            for cell_x in range(int(min_x), int(max_x) + 1)
+            for cell_y in range(int(min_y), int(max_y) + 1)
+        ]
+        slices = [cell for cell in slices if cell]
+        if not slices:
+            return []
+        candidates = np.concatenate([np.arange(start, end) for start, end in slices])
+
+        # 2. Distances of candidate points, keeping those within the radius
+        dy = (self.lats[candidates] - lat) * METRES_PER_DEGREE
+        dx = (self.lons[candidates] - lon) * METRES_PER_DEGREE * math.cos(math.radians(lat))
+        distances = np.hypot(dx, dy)
+
+        within = distances <= radius
+        candidates, distances = candidates[within], distances[within]
+
+        # 3. Nearest point of each shape, as the first occurrence of the shape once sorted by distance
+        order = np.argsort(distances, kind="stable")
+        candidates, distances = candidates[order], distances[order]
+        shape_indices, first = np.unique(self.shape_indices[candidates], return_index=True)
+
+        # 4. Nearest point of each route, across the shapes it follows
+        nearest: dict[str, dict] = {}
+        for shape_index, position in zip(shape_indices.tolist(), first.tolist()):
+            distance = float(distances[position])
+            for route_id in self.shape_routes[shape_index]:
+                if route_id not in nearest or distance < nearest[route_id]["distance"]:
+                    point = candidates[position]
+                    nearest[route_id] = {
+                        "route_id": route_id,
+                        "shape_id": self.shape_ids[shape_index],
+                        "shape_pt_lat": float(self.lats[point]),
+                        "shape_pt_lon": float(self.lons[point]),
+                        "distance": distance,
+                    }
+
+        results = sorted(nearest.values(), key=lambda result: result["distance"])
+        for result in results:
+            result["distance"] = round(result["distance"], 1)
+        return results
+
+
+def build_grid_index(shape_points: list[dict], route_summaries: list[dict]) -> GridIndex:
+    """
+    Build a grid index of shape points, labelled with the routes following each shape.
+
+    Args:
+        shape_points (list[dict]): Documents with shape_id, shape_pt_lat and shape_pt_lon.
+        route_summaries (list[dict]): Documents with route_id and shape_ids, such as route summaries.
+    """
+    # 1. Routes following each shape
+    routes_by_shape: dict[str, list[str]] = {}
+    for summary in route_summaries:
+        for shape_id in summary.get("shape_ids") or []:
+            routes_by_shape.setdefault(str(shape_id), []).append(summary["route_id"])
+
+    # 2. Coordinates of points of shapes followed by a route
+    points = pd.DataFrame(shape_points, columns=["shape_id", "shape_pt_lat", "shape_pt_lon"])
+    points = points.astype({"shape_id": str})
+    points = points[points["shape_id"].isin(routes_by_shape.keys())].dropna()
+
+    shape_indices, shape_ids = pd.factorize(points["shape_id"])
+    shape_ids = shape_ids.tolist()
+
+    index = GridIndex(
+        lats=points["shape_pt_lat"].to_numpy(dtype=np.float64),
+        lons=points["shape_pt_lon"].to_numpy(dtype=np.float64),
+        shape_indices=shape_indices.astype(np.int64),
+        shape_ids=shape_ids,
+        shape_routes=[routes_by_shape[shape_id] for shape_id in shape_ids],
+    )
+
+    print(f"Built spatial index of {len(index)} shape points from {len(shape_ids)} shapes")
+    return index
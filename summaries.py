@@ -0,0 +1,206 @@
+import os
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+from config import MyFile
+from utils import get_types_from_path
+
+
+def build_route_summaries(folder: MyFile, transports: dict[str, str], version: datetime) -> list[dict]:
+    """
+    Aggregate per-route summaries from the extracted trips and shapes of every transport.
+
+    Args:
+        folder (MyFile): Folder containing the extracted GTFS files.
+        transports (dict[str, str]): Dictionary of transport numbers and types.
+        version (datetime): Version added to every summary.
+
+    Returns:
+        list[dict]: One summary per route, with its trip count, shape IDs, headsigns and bounding box.
+    """
+    summaries = []
+
+    for root, dirs, files in os.walk(folder.path):
+        if "trips.txt" not in files:
+            continue
+
+        trips_path = os.path.join(root, "trips.txt")
+        shapes_path = os.path.join(root, "shapes.txt")
+        file_type, transport_type = get_types_from_path(trips_path, transports)
+
+        trips = pd.read_csv(trips_path)
+        shapes = pd.read_csv(shapes_path) if "shapes.txt" in files else None
+
+        summary = summarise_routes(trips, shapes)
+        summary['transport'] = transport_type
+        summaries.extend({**record, "version": version} for record in summary.to_dict('records'))
+
+    print(f"Built {len(summaries)} route summaries")
+    return summaries
+
+
+def summarise_routes(trips: pd.DataFrame, shapes: pd.DataFrame | None) -> pd.DataFrame:
+    """
+    Group trips (and the shapes they follow) by route.
+
+    Returns:
+        pd.DataFrame: One row per route_id, with columns route_id, trip_count, shape_ids, headsigns and bounding_box.
+    """
+    routes = trips.groupby("route_id")
+
+    # 1. Trip counts, and the distinct shapes and headsigns of each route
+    summary = pd.DataFrame({"trip_count": routes.size()})
+    summary['shape_ids'] = routes["shape_id"].agg(distinct_values) if "shape_id" in trips.columns else None
+    summary['headsigns'] = routes["trip_headsign"].agg(distinct_values) if "trip_headsign" in trips.columns else None
+    summary['bounding_box'] = None
+
+    # 2. Bounding box of each shape, then of all shapes of each route
+    if shapes is not None and "shape_id" in trips.columns:
+        shape_bounds = shapes.groupby("shape_id").agg(
+            min_lat=("shape_pt_lat", "min"),
+            min_lon=("shape_pt_lon", "min"),
+            max_lat=("shape_pt_lat", "max"),
+            max_lon=("shape_pt_lon", "max"),
+        )
+        route_shapes = trips[["route_id", "shape_id"]].dropna().drop_duplicates()
+        route_bounds = route_shapes.join(shape_bounds, on="shape_id", how="inner").groupby("route_id").agg(
+            min_lat=("min_lat", "min"),
+            min_lon=("min_lon", "min"),
+            max_lat=("max_lat", "max"),
+            max_lon=("max_lon", "max"),
+        )
+        bounding_boxes = pd.Series(route_bounds.to_dict('index'), dtype=object)
+        summary['bounding_box'] = bounding_boxes.reindex(summary.index)
+
+    summary = summary.astype({"trip_count": int}).reset_index()
+    return summary.astype(object).where(summary.notna(), None)
+
+
+def distinct_values(values: pd.Series) -> list:
+    """Sorted distinct values of a series, as native Python types."""
+    return sorted(values.dropna().unique().tolist())
+
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def build_service_days(folder: MyFile, transports: dict[str, str], version: datetime) -> list[dict]:
+    """
+    Turn the extracted calendar and calendar dates of every transport into a bitset of active dates
+    per service_id.
+
+    Args:
+        folder (MyFile): Folder containing the extracted GTFS files.
+        transports (dict[str, str]): Dictionary of transport numbers and types.
+        version (datetime): Version added to every service.
+
+    Returns:
+        list[dict]: One document per service, see summarise_service_days.
+    """
+    service_days = []
+
+    for root, dirs, files in os.walk(folder.path):
+        if "calendar.txt" not in files and "calendar_dates.txt" not in files:
+            continue
+
+        calendar_path = os.path.join(root, "calendar.txt")
+        calendar_dates_path = os.path.join(root, "calendar_dates.txt")
+        file_type, transport_type = get_types_from_path(calendar_path, transports)
+
+        calendar = pd.read_csv(calendar_path) if "calendar.txt" in files else None
+        calendar_dates = pd.read_csv(calendar_dates_path) if "calendar_dates.txt" in files else None
+
+        for service in summarise_service_days(calendar, calendar_dates):
+            service_days.append({**service, "transport": transport_type, "version": version})
+
+    print(f"Built active dates of {len(service_days)} services")
+    return service_days
+
+
+def summarise_service_days(calendar: pd.DataFrame | None, calendar_dates: pd.DataFrame | None) -> list[dict]:
+    """
+    Compute the dates each service runs on, from its weekly pattern and its added or removed dates.
+
+    Returns:
+        list[dict]: One document per service_id, with start_date (ISO format), days (number of dates
+            covered from start_date) and bitset (bit i, in little-endian bit order, set if the service
+            runs on start_date + i days).
+    """
+    # 1. Convert GTFS dates (YYYYMMDD) to days since 1 January 1970
+    if calendar is not None:
+        calendar = calendar.assign(
+            start_date=to_days(calendar["start_date"]),
+            end_date=to_days(calendar["end_date"]),
+        ).set_index("service_id")
+    if calendar_dates is not None:
+        calendar_dates = calendar_dates.assign(date=to_days(calendar_dates["date"]))
+
+    # 2. Date range covered by each service, across both files
+    ranges = []
+    if calendar is not None:
+        ranges.append(calendar[["start_date", "end_date"]])
+    if calendar_dates is not None:
+        ranges.append(calendar_dates.groupby("service_id")["date"].agg(start_date="min", end_date="max"))
+    service_ranges = pd.concat(ranges).groupby(level=0).agg(
+        start_date=("start_date", "min"),
+        end_date=("end_date", "max"),
+    )
+
+    exceptions = calendar_dates.groupby("service_id") if calendar_dates is not None else None
+
+    services = []
+    # Iterate as lists, so IDs are native Python types
+    for service_id, start_date, end_date in zip(service_ranges.index.tolist(),
+                                                service_ranges["start_date"].tolist(),
+                                                service_ranges["end_date"].tolist()):
+        if end_date < start_date:
+            # A calendar ending before it starts, with no added dates, never runs
+            continue
+
+        days = np.arange(start_date, end_date + 1)
+        active = np.zeros(len(days), dtype=bool)
+
+        # 3. Weekly pattern between its start and end dates
+        if calendar is not None and service_id in calendar.index:
+            pattern = calendar.loc[service_id]
+            runs_on_weekday = pattern[WEEKDAYS].to_numpy(dtype=bool)
+            weekdays = (days + 3) % 7      # 1 January 1970 was a Thursday
+            active = runs_on_weekday[weekdays] & (days >= pattern["start_date"]) & (days <= pattern["end_date"])
+
+        # 4. Added (1) and removed (2) dates
+        if exceptions is not None and service_id in exceptions.groups:
+            service_exceptions = exceptions.get_group(service_id)
+            offsets = service_exceptions["date"].to_numpy() - days[0]
+            active[offsets[service_exceptions["exception_type"].to_numpy() == 1]] = True
+            active[offsets[service_exceptions["exception_type"].to_numpy() == 2]] = False
+
+        services.append({
+            "service_id": service_id,
+            "start_date": str(np.datetime64(int(days[0]), "D")),
+            "days": len(days),
+            "bitset": np.packbits(active, bitorder="little").tobytes(),
+        })
+
+    return services
+
+
+def to_days(dates: pd.Series) -> np.ndarray:
+    """Convert GTFS dates (YYYYMMDD) to days since 1 January 1970."""
+    return pd.to_datetime(dates.astype(str), format="%Y%m%d").to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def get_active_service_ids(service_days: list[dict], day: date) -> list:
+    """
+    Returns:
+        list: IDs of the services running on a day.
+    """
+    active = []
+
+    for service in service_days:
+        offset = (day - date.fromisoformat(service["start_date"])).days
+        if 0 <= offset < service["days"] and service["bitset"][offset // 8] >> (offset % 8) & 1:
+            active.append(service["service_id"])
+
+    return active
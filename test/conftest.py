@@ -0,0 +1,4 @@
+import os
+
+# Set before config is loaded by any test, so the client doesn't resolve the Atlas SRV record
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017")
@@ -1,5 +1,5 @@
 from config import KEEP_TEMP_FILES, IGNORE_VERSION_CHECK, MOCK_OLD_DATE, KEEP_OUTDATED_DATA, USE_LIVE_MONGODB, \
-    MOCK_MONGODB_UNAVAILABLE
+    MOCK_MONGODB_UNAVAILABLE, SKIP_SNAPSHOT
 
 
 def main():
@@ -11,7 +11,8 @@ def main():
         "MOCK_OLD_DATE": MOCK_OLD_DATE,
         "KEEP_OUTDATED_DATA": KEEP_OUTDATED_DATA,
         "USE_LIVE_MONGODB": USE_LIVE_MONGODB,
-        "MOCK_MONGODB_UNAVAILABLE": MOCK_MONGODB_UNAVAILABLE
+        "MOCK_MONGODB_UNAVAILABLE": MOCK_MONGODB_UNAVAILABLE,
+        "SKIP_SNAPSHOT": SKIP_SNAPSHOT
     }
 
     for name, value in test_flags.items():
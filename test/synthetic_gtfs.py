@@ -0,0 +1,47 @@
+"""
+Synthetic GTFS feed, shared by the tests and by dev/load_test.py.
+"""
+import os
+import random
+
+
+def write_synthetic_gtfs(folder: str, routes: int, trips_per_route: int, points_per_shape: int) -> None:
+    """
+    Write Metropolitan Tram GTFS files (transport number 3) with two shapes per route, one per direction.
+    """
+    tram_folder = os.path.join(folder, "3")
+    os.makedirs(tram_folder, exist_ok=True)
+    rng = random.Random(0)
+
+    with open(os.path.join(tram_folder, "routes.txt"), "w") as f:
+        f.write("route_id,agency_id,route_short_name,route_long_name,route_type\n")
+        for route in range(routes):
+            f.write(f"3-{route},1,{route},Route {route},0\n")
+
+    with open(os.path.join(tram_folder, "trips.txt"), "w") as f:
+        f.write("route_id,service_id,trip_id,shape_id,trip_headsign,direction_id\n")
+        for route in range(routes):
+            for trip in range(trips_per_route):
+                direction = trip % 2
+                f.write(f"3-{route},T{trip % 3},{route}.{trip},3-{route}-{direction},Terminus {direction},{direction}\n")
+
+    with open(os.path.join(tram_folder, "shapes.txt"), "w") as f:
+        f.write("shape_id,shape_pt_lat,shape_pt_lon,shape_pt_sequence,shape_dist_traveled\n")
+        for route in range(routes):
+            for direction in range(2):
+                lat, lon, distance = -37.8136 + rng.uniform(-0.1, 0.1), 144.9631 + rng.uniform(-0.1, 0.1), 0.0
+                for sequence in range(1, points_per_shape + 1):
+                    f.write(f"3-{route}-{direction},{lat:.6f},{lon:.6f},{sequence},{distance:.2f}\n")
+                    lat += rng.uniform(-0.0004, 0.0004)
+                    lon += rng.uniform(-0.0004, 0.0004)
+                    distance += rng.uniform(5, 40)
+
+    with open(os.path.join(tram_folder, "calendar.txt"), "w") as f:
+        f.write("service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date\n")
+        f.write("T0,1,1,1,1,1,0,0,20250101,20251231\n")
+        f.write("T1,0,0,0,0,0,1,0,20250101,20251231\n")
+        f.write("T2,0,0,0,0,0,0,1,20250101,20251231\n")
+
+    with open(os.path.join(tram_folder, "calendar_dates.txt"), "w") as f:
+        f.write("service_id,date,exception_type\n")
+        f.write("T0,20251225,2\nT2,20251225,1\n")
@@ -0,0 +1,106 @@
+"""
+Radius searches of the grid index, checked against a brute force search over every shape point.
+
+Usage:
+    python -m pytest test
+"""
+import math
+
+import numpy as np
+import pytest
+
+from spatial import GridIndex, METRES_PER_DEGREE, build_grid_index
+
+CENTRE = (-37.8136, 144.9631)
+
+
+def brute_force(shape_points: list[dict], route_summaries: list[dict], lat: float, lon: float,
+                radius: float) -> dict[str, float]:
+    """Distance to the nearest point of each route within radius, measured as GridIndex.query does."""
+    nearest: dict[str, float] = {}
+    for summary in route_summaries:
+        for point in shape_points:
+            if point["shape_id"] not in summary["shape_ids"]:
+                continue
+            dy = (point["shape_pt_lat"] - lat) * METRES_PER_DEGREE
+            dx = (point["shape_pt_lon"] - lon) * METRES_PER_DEGREE * math.cos(math.radians(lat))
+            distance = math.hypot(dx, dy)
+            if distance <= radius and distance < nearest.get(summary["route_id"], math.inf):
+                nearest[summary["route_id"]] = distance
+    return nearest
+
+
+@pytest.fixture(scope="module")
+def network():
+    """Random walks around the centre, with a route sharing a shape and a route following two shapes."""
+    rng = np.random.default_rng(0)
+    shape_points = []
+    for shape in range(8):
+        lat, lon = CENTRE[0] + rng.uniform(-0.02, 0.02), CENTRE[1] + rng.uniform(-0.02, 0.02)
+        for _ in range(200):
+            shape_points.append({"shape_id": f"S{shape}", "shape_pt_lat": lat, "shape_pt_lon": lon})
+            lat += rng.uniform(-0.0005, 0.0005)
+            lon += rng.uniform(-0.0005, 0.0005)
+
+    route_summaries = [
+        {"route_id": "R0", "shape_ids": ["S0", "S1"]},
+        {"route_id": "R1", "shape_ids": ["S1"]},             # shares S1 with R0
+        {"route_id": "R2", "shape_ids": ["S2", "S3", "S4"]},
+        {"route_id": "R3", "shape_ids": ["S5"]},
+        {"route_id": "R4", "shape_ids": ["S6"]},             # S7 is followed by no route
+    ]
+    return shape_points, route_summaries
+
+
+@pytest.mark.parametrize("lat, lon, radius", [
+    (*CENTRE, 100),
+    (*CENTRE, 500),
+    (*CENTRE, 2000),
+    (CENTRE[0] + 0.01, CENTRE[1] - 0.01, 800),
+    (CENTRE[0] - 0.015, CENTRE[1] + 0.015, 1500),
+    (CENTRE[0] + 0.5, CENTRE[1], 2000),     # far from every shape
+])
+def test_query_matches_brute_force(network, lat, lon, radius):
+    shape_points, route_summaries = network
+    index = build_grid_index(shape_points, route_summaries)
+
+    results = index.query(lat, lon, radius)
+    expected = brute_force(shape_points, route_summaries, lat, lon, radius)
+
+    assert {result["route_id"]: result["distance"] for result in results} == pytest.approx(
+        {route_id: round(distance, 1) for route_id, distance in expected.items()})
+    assert [result["distance"] for result in results] == sorted(result["distance"] for result in results)
+
+
+def test_query_returns_nearest_point_of_each_route(network):
+    shape_points, route_summaries = network
+    index = build_grid_index(shape_points, route_summaries)
+    shapes_by_route = {summary["route_id"]: summary["shape_ids"] for summary in route_summaries}
+
+    for result in index.query(*CENTRE, 2000):
+        # The point is on one of the route's shapes, at the reported distance
+        assert result["shape_id"] in shapes_by_route[result["route_id"]]
+        assert {"shape_id": result["shape_id"], "shape_pt_lat": result["shape_pt_lat"],
+                "shape_pt_lon": result["shape_pt_lon"]} in shape_points
+
+
+@pytest.mark.parametrize("cell_metres, offset_metres, radius, found", [
+    (250, 240, 250, True),      # in the neighbouring cell, within the radius
+    (250, 260, 250, False),     # in the neighbouring cell, past the radius
+    (100, 950, 1000, True),     # several cells away, within the radius
+    (1000, 10, 20, True),       # in the neighbouring cell, radius much smaller than a cell
+])
+def test_query_cell_range(cell_metres, offset_metres, radius, found):
+    # A single point east of a location on a cell boundary
+    lat, lon = CENTRE
+    cell_lon = math.floor(lon * METRES_PER_DEGREE * math.cos(math.radians(lat)) / cell_metres)
+    boundary_lon = cell_lon * cell_metres / (METRES_PER_DEGREE * math.cos(math.radians(lat)))
+    point_lon = boundary_lon + offset_metres / (METRES_PER_DEGREE * math.cos(math.radians(lat)))
+
+    index = GridIndex(
+        lats=np.array([lat]), lons=np.array([point_lon]), shape_indices=np.array([0]),
+        shape_ids=["S0"], shape_routes=[["R0"]], cell_metres=cell_metres,
+    )
+
+    results = index.query(lat, boundary_lon - 1e-9, radius)
+    assert [result["route_id"] for result in results] == (["R0"] if found else [])
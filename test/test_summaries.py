@@ -0,0 +1,103 @@
+"""
+Service days of each service, from calendar.txt and calendar_dates.txt, and the services running on a day.
+
+Usage:
+    python -m pytest test
+"""
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+from summaries import summarise_service_days, get_active_service_ids
+
+CALENDAR_COLUMNS = ["service_id", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday",
+                    "start_date", "end_date"]
+CALENDAR_DATES_COLUMNS = ["service_id", "date", "exception_type"]
+
+WEEKDAYS_ONLY = [1, 1, 1, 1, 1, 0, 0]
+WEEKENDS_ONLY = [0, 0, 0, 0, 0, 1, 1]
+
+
+def calendar(*rows) -> pd.DataFrame:
+    return pd.DataFrame([[service_id, *weekdays, start, end] for service_id, weekdays, start, end in rows],
+                        columns=CALENDAR_COLUMNS)
+
+
+def calendar_dates(*rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=CALENDAR_DATES_COLUMNS)
+
+
+def running_days(service_days: list[dict], first: date, last: date) -> dict[str, list[date]]:
+    """Days each service runs on between first and last, inclusive, as read back by get_active_service_ids."""
+    running: dict[str, list[date]] = {service["service_id"]: [] for service in service_days}
+    day = first
+    while day <= last:
+        for service_id in get_active_service_ids(service_days, day):
+            running[service_id].append(day)
+        day += timedelta(days=1)
+    return running
+
+
+# Monday 6 January 2025 to Sunday 12 January 2025
+@pytest.mark.parametrize("calendar_rows, exception_rows, expected", [
+    pytest.param(
+        [("W", WEEKDAYS_ONLY, 20250106, 20250112)], [],
+        {"W": [6, 7, 8, 9, 10]},
+        id="weekday pattern",
+    ),
+    pytest.param(
+        [("W", WEEKDAYS_ONLY, 20250106, 20250112), ("E", WEEKENDS_ONLY, 20250106, 20250112)], [],
+        {"W": [6, 7, 8, 9, 10], "E": [11, 12]},
+        id="two patterns",
+    ),
+    pytest.param(
+        [("W", WEEKDAYS_ONLY, 20250106, 20250112)], [("W", 20250108, 2), ("W", 20250111, 1)],
+        {"W": [6, 7, 9, 10, 11]},
+        id="removed and added dates",
+    ),
+    pytest.param(
+        [("W", WEEKDAYS_ONLY, 20250106, 20250108)], [("W", 20250112, 1)],
+        {"W": [6, 7, 8, 12]},
+        id="added date after the calendar ends",
+    ),
+    pytest.param(
+        [], [("X", 20250107, 1), ("X", 20250110, 1)],
+        {"X": [7, 10]},
+        id="only added dates",
+    ),
+    pytest.param(
+        [("W", WEEKDAYS_ONLY, 20250106, 20250112), ("R", WEEKDAYS_ONLY, 20250112, 20250106)], [],
+        {"W": [6, 7, 8, 9, 10]},
+        id="calendar ending before it starts",
+    ),
+])
+def test_summarise_service_days(calendar_rows, exception_rows, expected):
+    service_days = summarise_service_days(
+        calendar(*calendar_rows) if calendar_rows else None,
+        calendar_dates(*exception_rows) if exception_rows else None,
+    )
+
+    running = running_days(service_days, date(2025, 1, 1), date(2025, 1, 31))
+    assert running == {
+        service_id: [date(2025, 1, day) for day in days]
+        for service_id, days in expected.items()
+    }
+
+
+# Runs on offsets 0, 8 and 9 of 10 days; bit 10 is set but past the end, in the padding of the last byte
+SERVICE = {"service_id": "S", "start_date": "2025-01-01", "days": 10, "bitset": bytes([0b00000001, 0b00000111])}
+
+@pytest.mark.parametrize("offset, running", [
+    (-1, False),    # before start_date
+    (0, True),
+    (1, False),
+    (7, False),     # last bit of the first byte
+    (8, True),      # first bit of the second byte
+    (9, True),      # last day
+    (10, False),    # set in the padding, but past the last day
+    (365, False),   # past the bitset
+])
+def test_get_active_service_ids_offsets(offset, running):
+    day = date(2025, 1, 1) + timedelta(days=offset)
+    assert get_active_service_ids([SERVICE], day) == (["S"] if running else [])
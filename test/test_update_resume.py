@@ -0,0 +1,126 @@
+"""
+Resuming an update after a failed insert, against an in-memory MongoDB (mongomock).
+
+Usage:
+    python -m pytest test
+"""
+import os
+from datetime import datetime
+
+import mongomock
+import pytest
+
+import data_processing
+import database
+from config import EXTRACTED_DIRECTORY, MONGO_DATABASE, SNAPSHOT_FILE, ROUTE_SUMMARY_COLLECTION, SERVICE_DAYS_COLLECTION
+from test.synthetic_gtfs import write_synthetic_gtfs
+
+OLD_VERSION = datetime(2025, 1, 1)
+NEW_VERSION = datetime(2025, 2, 1)
+TRANSPORTS = {"3": "Metropolitan Tram"}
+
+
+@pytest.fixture
+def update(tmp_path, monkeypatch):
+    """Patches the network out of update_gtfs_data, and seeds MongoDB with a committed old version."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "client", mongomock.MongoClient())
+    monkeypatch.setattr(database, "catalog_cache", None)
+    monkeypatch.setattr(database, "catalog_checked", None)
+    monkeypatch.setattr(data_processing, "CATALOG_REFRESH_SECONDS", 0)
+
+    monkeypatch.setattr(data_processing, "is_db_connected", lambda: True)
+    monkeypatch.setattr(data_processing, "fetch_gtfs_data", lambda: (NEW_VERSION, "gtfs.zip", None))
+    monkeypatch.setattr(data_processing, "fetch_site_metadata", lambda: (None, None))
+    monkeypatch.setattr(data_processing, "parse_transport_types", lambda soup, transport_filter: TRANSPORTS)
+    monkeypatch.setattr(
+        data_processing, "download_and_extract_gtfs",
+        lambda link, transports, version, checkpoint: write_synthetic_gtfs(EXTRACTED_DIRECTORY.path, 4, 10, 500)
+    )
+
+    # Old version, already committed
+    db = database.client[MONGO_DATABASE]
+    db.metropolitan_tram_routes.insert_one({"route_id": "old", "version": OLD_VERSION})
+    database.update_catalog(OLD_VERSION, [{
+        "name": "metropolitan_tram_routes", "transport": "metropolitan_tram", "route_type": "tram",
+        "file_type": "routes", "count": 1,
+    }])
+    database.update_data_version(OLD_VERSION)
+
+    return db
+
+
+def refresh_catalog(monkeypatch) -> None:
+    monkeypatch.setattr(database, "catalog_checked", None)
+
+
+def test_failed_insert_resumes_without_publishing(update, monkeypatch):
+    db = update
+    add_to_database = database.add_to_database
+
+    # 1. Fail every insert to shapes
+    def failing_add_to_database(collection_name: str, records: list[dict]) -> None:
+        if collection_name == "metropolitan_tram_shapes":
+            raise Exception("network timeout")
+        add_to_database(collection_name, records)
+
+    monkeypatch.setattr(data_processing, "add_to_database", failing_add_to_database)
+    with pytest.raises(Exception, match="metropolitan_tram_shapes"):
+        data_processing.update_gtfs_data()
+
+    # Readers still see only the old version
+    refresh_catalog(monkeypatch)
+    assert database.get_data_version() == OLD_VERSION
+    assert not os.path.exists(SNAPSHOT_FILE.path)
+    assert [route["route_id"] for route in database.get_routes(None)] == ["old"]
+
+    stages = database.get_update_checkpoint(NEW_VERSION)["stages"]
+    assert set(stages["ingest"]["collections"]) == {
+        "metropolitan_tram_routes", "metropolitan_tram_trips",
+        "metropolitan_tram_calendar", "metropolitan_tram_calendar_dates",
+    }
+    assert "commit" not in stages
+
+    # 2. Resume, recording which collections are inserted again
+    inserted: set[str] = set()
+
+    def recording_add_to_database(collection_name: str, records: list[dict]) -> None:
+        inserted.add(collection_name)
+        add_to_database(collection_name, records)
+
+    monkeypatch.setattr(data_processing, "add_to_database", recording_add_to_database)
+    assert data_processing.update_gtfs_data() is True
+
+    # Derived collections are built after ingest, so only shapes is ingested again
+    assert inserted - {ROUTE_SUMMARY_COLLECTION, SERVICE_DAYS_COLLECTION} == {"metropolitan_tram_shapes"}
+    assert db.metropolitan_tram_shapes.count_documents({"version": NEW_VERSION}) == 4 * 2 * 500
+
+    # New version is committed, published and the old version deleted
+    refresh_catalog(monkeypatch)
+    assert database.get_data_version() == NEW_VERSION
+    assert os.path.exists(SNAPSHOT_FILE.path)
+    assert db.metropolitan_tram_routes.count_documents({"version": OLD_VERSION}) == 0
+    assert sorted(route["route_id"] for route in database.get_routes(None)) == ["3-0", "3-1", "3-2", "3-3"]
+    assert set(database.get_update_checkpoint(NEW_VERSION)["stages"]) >= {"build", "commit", "publish"}
+
+
+def test_parse_error_is_not_checkpointed(update, monkeypatch):
+    # 1. Shapes file with a malformed row at the end
+    def write_malformed_gtfs(link, transports, version, checkpoint) -> None:
+        write_synthetic_gtfs(EXTRACTED_DIRECTORY.path, 4, 10, 500)
+        with open(os.path.join(EXTRACTED_DIRECTORY.path, "3", "shapes.txt"), "a") as f:
+            f.write("3-0-0,-37.8,144.9,501,0.0,extra,columns\n")
+
+    monkeypatch.setattr(data_processing, "download_and_extract_gtfs", write_malformed_gtfs)
+    with pytest.raises(Exception, match="shapes"):
+        data_processing.update_gtfs_data()
+
+    # Other collections still finish inserting, while shapes is neither checkpointed nor taken as
+    # completed by a resumed run
+    ingest_checkpoint = database.get_update_checkpoint(NEW_VERSION).get("stages", {}).get("ingest")
+    assert set(ingest_checkpoint["collections"]) == {
+        "metropolitan_tram_routes", "metropolitan_tram_trips",
+        "metropolitan_tram_calendar", "metropolitan_tram_calendar_dates",
+    }
+    assert "metropolitan_tram_shapes" not in data_processing.get_completed_collections(ingest_checkpoint, NEW_VERSION)
+    assert database.get_data_version() == OLD_VERSION
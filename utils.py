@@ -1,8 +1,9 @@
+import hashlib
 import os
 import shutil
 import re
 
-from config import MyFile, KEEP_TEMP_FILES, TRANSPORTS
+from config import MyFile, KEEP_TEMP_FILES
 from pathlib import Path
 
 def delete_file(file: MyFile) -> None:
@@ -37,8 +38,8 @@ def get_types_from_path(file_path: str, transports: dict[str, str]) -> tuple[str
     # 1. Determine GTFS file type from path
     file_type = Path(file_path).stem
 
-    # 2. Extract transport number from path
-    match = re.search(r'\d+', file_path)
+    # 2. Extract transport number from the file's folder
+    match = re.search(r'\d+', Path(file_path).parent.name)
     transport_num = match.group() if match else None
 
     # 3. Validate presence of both
@@ -55,24 +56,30 @@ def get_types_from_path(file_path: str, transports: dict[str, str]) -> tuple[str
         )
 
     # 5. Normalise transport string
-    transport_str = transport_str.replace(' ', '_').lower()
+    transport_str = normalise_transport(transport_str)
 
     return file_type, transport_str
 
 
-def get_keep_file_basenames() -> list[str]:
+def normalise_transport(transport: str) -> str:
     """
-    Return the base names (without extensions) of GTFS Schedule files that are kept.
+    Normalise a transport name for use in collection names.
 
     Example:
-        ['stops.txt', 'routes.txt'] → ['stops', 'routes']
+        'Metropolitan Tram' → 'metropolitan_tram'
     """
-    files = []
+    return transport.replace(' ', '_').lower()
 
-    for file in TRANSPORTS.values():
-        if file in files:
-            break
-        else:
-            files.extend(file)
 
-    return [Path(file).stem for file in files]
\ No newline at end of file
+
+def get_file_hash(path: str) -> str:
+    """
+    Return the SHA-256 hex digest of a file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
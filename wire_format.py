@@ -0,0 +1,105 @@
+"""
+Compact column-oriented MessagePack encoding of GTFS documents.
+
+Payload layout:
+    {
+        "count": number of documents,
+        "columns": {field: [value of each document]},
+        "encodings": {field: encoding}     # only for encoded columns
+    }
+
+Column encodings:
+    {"type": "delta", "scale": s}       values are fixed-point integers (value * s), each stored as the
+                                        difference from the previous one; s is 1 for integer columns
+    {"type": "dictionary", "values": v} values are indices into v
+"""
+import msgpack
+import numpy as np
+
+MSGPACK_MIMETYPE = "application/x-msgpack"
+
+# Columns stored as fixed-point integers, with their scale (1e6 is about 0.1 m for coordinates)
+FIXED_POINT_COLUMNS: dict[str, int] = {
+    "shape_pt_lat": 1_000_000,
+    "shape_pt_lon": 1_000_000,
+}
+
+
+def pack_columnar(documents: list[dict]) -> bytes:
+    """
+    Encode documents as a columnar MessagePack payload.
+
+    Args:
+        documents (list[dict]): Documents sharing the same fields, such as those returned by get_shapes.
+    """
+    fields = list(documents[0].keys()) if documents else []
+    columns = {}
+    encodings = {}
+
+    for field in fields:
+        values = [document.get(field) for document in documents]
+        columns[field], encoding = encode_column(field, values)
+        if encoding:
+            encodings[field] = encoding
+
+    payload = {"count": len(documents), "columns": columns, "encodings": encodings}
+    return msgpack.packb(payload)
+
+
+def encode_column(field: str, values: list) -> tuple[list, dict | None]:
+    """
+    Returns:
+        tuple[list, dict | None]: Encoded values, and their encoding, or None if stored as is.
+    """
+    # Missing values are stored as is, as they can't be delta or dictionary encoded
+    if any(value is None for value in values):
+        return values, None
+
+    # 1. Fixed-point coordinates and integers, as deltas
+    if field in FIXED_POINT_COLUMNS:
+        scale = FIXED_POINT_COLUMNS[field]
+        fixed_point = np.round(np.array(values, dtype=np.float64) * scale).astype(np.int64)
+        return delta_encode(fixed_point), {"type": "delta", "scale": scale}
+
+    if values and all(type(value) is int for value in values):
+        return delta_encode(np.array(values, dtype=np.int64)), {"type": "delta", "scale": 1}
+
+    # 2. Repeated strings, as indices into their distinct values
+    if values and all(isinstance(value, str) for value in values):
+        distinct = list(dict.fromkeys(values))
+        if len(distinct) <= len(values) // 2:
+            indices = {value: index for index, value in enumerate(distinct)}
+            return [indices[value] for value in values], {"type": "dictionary", "values": distinct}
+
+    return values, None
+
+
+def delta_encode(values: np.ndarray) -> list[int]:
+    if len(values) == 0:
+        return []
+
+    return [int(values[0])] + np.diff(values).tolist()
+
+
+def unpack_columnar(data: bytes) -> list[dict]:
+    """
+    Decode a columnar MessagePack payload back to documents, as a reference for clients.
+    """
+    payload = msgpack.unpackb(data)
+    columns = {}
+
+    for field, values in payload["columns"].items():
+        encoding = payload["encodings"].get(field)
+
+        if encoding is None:
+            columns[field] = values
+        elif encoding["type"] == "delta":
+            decoded = np.cumsum(np.array(values, dtype=np.int64))
+            columns[field] = decoded.tolist() if encoding["scale"] == 1 else (decoded / encoding["scale"]).tolist()
+        elif encoding["type"] == "dictionary":
+            columns[field] = [encoding["values"][index] for index in values]
+
+    return [
+        {field: values[index] for field, values in columns.items()}
+        for index in range(payload["count"])
+    ]